@@ -1,25 +1,11 @@
 import os
-import csv
 from typing import NamedTuple
 from typing import Optional
 from enum import Enum
 
-# Enum for locations
-class Location(Enum):
-    BROCK_COMMONS = "Brock Commons"
-    EXCHANGE = "Exchange"
-    FAIRVIEW_CRESCENT = "Fairview Crescent"
-    FRASER_HALL = "Fraser Hall"
-    GREEN_COLLEGE = "Green College"
-    IONA_HOUSE = "Iona House"
-    MARINE_DRIVE = "Marine Drive"
-    PONDEROSA_COMMONS = "Ponderosa Commons"
-    ST_JOHNS_COLLEGE = "St. John’s College"
-    TESHXWHELELMS_TEKWAƛKEʔAʔL = "tə šxʷhəleləm̓s tə k̓ʷaƛ̓kʷəʔaʔɬ"
-    WESBROOK_VILLAGE = "Wesbrook Village"
-    KITSILANO = "Kitsilano"
-    RICHMOND = "Richmond"
-    WEST_POINT_GREY = "West Point Grey"
+from listing import Location
+from duplicates import append_posts, read_listings
+from listing_store import get_store
 
 # Enum for floor preference
 class Floor(Enum):
@@ -98,14 +84,14 @@ def create_and_append_post_to_csv(filename: str):
 
     # Append the new data to the CSV file
     try:
-        with open(filename, mode='a', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=UserData._fields)
-            # If file is empty, write the header
-            if csvfile.tell() == 0:
-                writer.writeheader()
-            # Convert the UserData instance to a dictionary and write the new row
-            writer.writerow(new_user_data._asdict())
+        # Goes through the same locked writer as the API, so running servers
+        # can pick the row up by reading only the appended bytes; re-posts of
+        # an existing listing are flagged
+        _, reports = append_posts(get_store(filename, read_listings), [new_user_data._asdict()],
+                                  fieldnames=UserData._fields)
         print("New post successfully added to the CSV file.")
+        for _, report in reports:
+            print(f"Note: this looks like a re-post of listing {', '.join(report['duplicate_of'])}.")
     except Exception as e:
         print(f"An error occurred while appending to the CSV: {e}")
 
@@ -1,40 +1,12 @@
 import os
 import csv
-from typing import NamedTuple, List, Optional
-from enum import Enum
+from typing import List, Optional
 
-class FloorPreference(Enum):
-    BOTTOM = "bottom"
-    MIDDLE = "middle"
-    TOP = "top"
+from listing import FloorPreference, Listing
+from listing_store import CsvLoader, get_store
+from ranking import rank_and_sort_all_features
 
-class UserData(NamedTuple):
-    cst: int  # Cost (required integer)
-    location: bool  # Location (True = on campus, False = off)
-    descr: Optional[str]  # Description (optional string)
-    rooms: Optional[int]  # Number of rooms (optional integer)
-    ppl: Optional[int]  # Number of people (optional integer)
-    length: Optional[str]  # Lease length (optional string)
-    laundry: Optional[bool]  # Laundry available (optional boolean)
-    parking: Optional[bool]  # Parking available (optional boolean)
-    gender: Optional[str]  # Gender preference (optional string)
-    floor: Optional[FloorPreference]  # Preferred floor (optional enum)
-    pets: Optional[bool]  # Pets allowed (optional boolean)
-
-def lease_length_comparator(length: Optional[str]) -> int:
-    """Convert lease length to an integer representing the lease duration for sorting."""
-    if not length:
-        return 0  # No preference or no length
-    length = length.lower()
-    if "month" in length:
-        return int(length.split()[0])
-    elif "year" in length:
-        return int(length.split()[0]) * 12  # Convert years to months
-    elif "week" in length:
-        return int(length.split()[0]) // 4  # Convert weeks to months (approx.)
-    return 0
-
-def read_user_data_from_csv(filename: str) -> List[UserData]:
+def read_user_data_from_csv(filename: str) -> List[Listing]:
     user_data_list = []
     try:
         with open(filename, newline='', encoding='utf-8') as csvfile:
@@ -42,72 +14,16 @@ def read_user_data_from_csv(filename: str) -> List[UserData]:
             for row in reader:
                 if not any(row.values()):  # Skip empty rows
                     continue
-
-                floor = None
-                if row.get('floor'):
-                    try:
-                        floor = FloorPreference[row['floor'].upper()]
-                    except KeyError:
-                        pass
-
-                def parse_yes_no(value: str) -> Optional[bool]:
-                    return value.lower() == 'yes' if value else None
-
-                user_data_list.append(UserData(
-                    cst=int(row['cst']) if row['cst'] and row['cst'].isdigit() else 0,
-                    location=parse_yes_no(row['location']),
-                    descr=row.get('descr', None),
-                    rooms=int(row['rooms']) if row['rooms'] and row['rooms'].isdigit() else None,
-                    ppl=int(row['ppl']) if row['ppl'] and row['ppl'].isdigit() else None,
-                    length=row.get('length', None),
-                    laundry=parse_yes_no(row.get('laundry')),
-                    parking=parse_yes_no(row.get('parking')),
-                    gender=row.get('gender', None),
-                    floor=floor,
-                    pets=parse_yes_no(row.get('pets')),
-                ))
+                user_data_list.append(Listing.from_row(row))
     except FileNotFoundError:
         print(f"File {filename} not found!")
     except Exception as e:
         print(f"An error occurred: {e}")
     return user_data_list
 
-def safe_getattr(obj, attr, default=None):
-    """Safely get an attribute, returning a default if it doesn't exist or is None."""
-    return getattr(obj, attr, default) if obj else default
-
-def rank_and_sort_all_features(
-    user_data_list: List[UserData],
-    filters: Optional[dict] = None
-) -> List[UserData]:
-    """Rank and sort listings based on filters and sort order."""
-    if not filters:
-        filters = {}
-
-    sort_order = [
-        "cst", "location", "rooms", "length", "ppl",
-        "laundry", "parking", "gender", "floor", "pets"
-    ]
-    sort_order = [key for key in filters if key in sort_order] + [key for key in sort_order if key not in filters]
-
-    def calculate_fitness_score(user: UserData) -> int:
-        return sum(1 for key, value in filters.items() if value is not None and safe_getattr(user, key) == value)
-
-    def sort_key(user: UserData):
-        fitness_score = calculate_fitness_score(user)
-        key = [-fitness_score]  # Higher fitness comes first
-        for field in sort_order:
-            attribute = safe_getattr(user, field)
-            if field == "length":
-                attribute = lease_length_comparator(attribute)
-        # Replace None values with a default for sorting
-            if attribute is None:
-                attribute = float('inf') if field == "cst" else -float('inf')
-            key.append(attribute)
-        return tuple(key)
-
-
-    return sorted(user_data_list, key=sort_key, reverse=True)
+# Loader for the store main() ranks from; a store with a CsvLoader tracks
+# tombstoned rows, so live() leaves out deleted and replaced listings
+read_listings = CsvLoader(Listing.from_row)
 
 def get_user_preferences() -> dict:
     def safe_int(value: str) -> Optional[int]:
@@ -120,10 +36,11 @@ def get_user_preferences() -> dict:
         return value.lower() == 'yes' if value else None
 
     print("Enter your preferences (leave blank if no preference):")
-    cst = safe_int(input("Max Cost: "))
+    max_cst = safe_int(input("Max Cost: "))
     location = parse_yes_no(input("On Campus (yes/no): "))
-    rooms = safe_int(input("Number of Rooms: "))
-    ppl = safe_int(input("Number of People: "))
+    min_rooms = safe_int(input("Min Number of Rooms: "))
+    min_ppl = safe_int(input("Min Number of People: "))
+    max_ppl = safe_int(input("Max Number of People: "))
     length = input("Lease Length: ")
     laundry = parse_yes_no(input("Laundry in unit (yes/no): "))
     parking = parse_yes_no(input("Parking available (yes/no): "))
@@ -132,10 +49,11 @@ def get_user_preferences() -> dict:
     pets = parse_yes_no(input("Pets Allowed (yes/no): "))
 
     return {
-        "cst": cst,
+        "max_cst": max_cst,
         "location": location,
-        "rooms": rooms,
-        "ppl": ppl,
+        "min_rooms": min_rooms,
+        "min_ppl": min_ppl,
+        "max_ppl": max_ppl,
         "length": length,
         "laundry": laundry,
         "parking": parking,
@@ -144,13 +62,17 @@ def get_user_preferences() -> dict:
         "pets": pets,
     }
 
-# Example Usage
-filename = 'nwhack25/user_data.csv'
-user_data_list = read_user_data_from_csv(filename)
-user_preferences = get_user_preferences()
-ranked_list = rank_and_sort_all_features(user_data_list, filters=user_preferences)
+def main(filename: str = 'nwhack25/user_data.csv'):
+    user_data_list = get_store(filename, read_listings).live()
+    user_preferences = get_user_preferences()
+    ranked_list = rank_and_sort_all_features(user_data_list, filters=user_preferences)
+
+    for user in ranked_list:
+        print(user)
 
-for user in ranked_list:
-    print(user)
+    print("\nSorted Listings (All Listings, Most Fitting to Least Fitting):")
 
-print("\nSorted Listings (All Listings, Most Fitting to Least Fitting):")
+# Example Usage; importing this file only defines the functions above, see
+# batch_ranking.py to rank for many stored preferences at once
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Rank the listings for many preference profiles in one pass.
+
+The nightly digest ranks the same listings for thousands of stored profiles.
+Rather than sorting every listing once per profile, each distinct predicate
+is evaluated once over the columns. The fitness of a block of profiles is
+then one matrix product: profiles x predicates times predicates x rows.
+Each profile then only orders the rows that can still make its top k.
+
+    python batch_ranking.py profiles.jsonl [nwhack25/user_data.csv] [k] > digest.jsonl
+
+Profiles are NDJSON or a JSON array. Each entry is either a filter dict, or
+an object with "filters" and optionally "id", which is the format of
+saved_searches.json. Each output line is {"id": ..., "listings": [...]}
+holding the same listings, best first, as
+rank_and_sort_all_features(listings, filters, limit=k).
+"""
+import json
+import sys
+from typing import Any, Dict, IO, Iterable, List, Optional, Sequence, Tuple
+
+import columnar
+import geo
+from bulk_import import read_records
+from listing_index import plain_value
+from ranking import rank_and_sort_all_features
+from snapshot import load_snapshot
+
+np = columnar.np
+
+# Entries of one block's fitness matrix (profiles x rows)
+BLOCK_CELLS = 1 << 25
+
+# Predicate masks kept between blocks
+MAX_MASKS = 1024
+
+# (profile id, filters)
+Profile = Tuple[Any, dict]
+
+
+def read_profiles(text: str) -> List[Profile]:
+    """Profiles from NDJSON or a JSON array; an entry without an id is numbered by position."""
+    profiles = []
+    for position, record in read_records(text, "json" if text.lstrip().startswith("[") else "ndjson"):
+        if isinstance(record, Exception):
+            raise ValueError(f"profile {position}: {record}")
+        if not isinstance(record, dict):
+            raise ValueError(f"profile {position}: expected a JSON object")
+        if isinstance(record.get("filters"), dict):
+            profiles.append((record.get("id", position), record["filters"]))
+        else:
+            profiles.append((position, record))
+    return profiles
+
+
+def predicates(filters: dict) -> List[tuple]:
+    """The predicates a profile's fitness counts, as hashable keys.
+
+    A plain filter is (key, value); a radius is ("near", near, "within_km", km).
+    """
+    plain, geo_query = geo.split_filters(filters)
+    found = [(key, plain_value(value)) for key, value in plain.items() if value is not None]
+    if geo_query is not None and geo_query.within_km is not None:
+        found.append(("near", geo_query.near, "within_km", geo_query.within_km))
+    return found
+
+
+class BatchRanker:
+    """Top k listings for many filter dicts over one ListingColumns."""
+
+    def __init__(self, columns: "columnar.ListingColumns"):
+        self.columns = columns
+        self._masks: Dict[tuple, "np.ndarray"] = {}
+
+    def _mask(self, predicate: tuple) -> "np.ndarray":
+        mask = self._masks.get(predicate)
+        if mask is None:
+            if len(predicate) == 2:
+                filters = {predicate[0]: predicate[1]}
+            else:
+                filters = {"near": predicate[1], "within_km": predicate[3]}
+            mask = self.columns.fitness(filters).astype(np.float32)
+            if len(self._masks) >= MAX_MASKS:
+                self._masks.clear()
+            self._masks[predicate] = mask
+        return mask
+
+    def fitness(self, profiles: Sequence[dict]) -> "np.ndarray":
+        """Fitness of every row for each profile (profiles x rows)."""
+        rows = len(self.columns)
+        per_profile = [predicates(filters) for filters in profiles]
+        distinct = list(dict.fromkeys(predicate for found in per_profile for predicate in found))
+        if not distinct:
+            return np.zeros((len(profiles), rows), dtype=np.int64)
+        position = {predicate: i for i, predicate in enumerate(distinct)}
+        incidence = np.zeros((len(profiles), len(distinct)), dtype=np.float32)
+        for i, found in enumerate(per_profile):
+            for predicate in found:
+                incidence[i, position[predicate]] = 1
+        masks = np.stack([self._mask(predicate) for predicate in distinct])
+        # Counts are small integers, so float32 sums are exact
+        return np.rint(incidence @ masks).astype(np.int64)
+
+    def top_k(self, profiles: Sequence[dict], k: int) -> List["np.ndarray"]:
+        """Row ids of the k best listings for each profile, best first."""
+        results = []
+        block = max(1, min(len(profiles), BLOCK_CELLS // max(1, len(self.columns))))
+        for start in range(0, len(profiles), block):
+            chunk = profiles[start:start + block]
+            scores = self.fitness(chunk)
+            for filters, fitness in zip(chunk, scores):
+                results.append(columnar.top_rows(self.columns.sort_keys(filters, fitness), k))
+        return results
+
+
+def rank_profiles(listings, profiles: Sequence[dict], k: int = 10,
+                  columns: Optional["columnar.ListingColumns"] = None) -> List[List]:
+    """The top k listings for each filter dict, best first.
+
+    Uses columns (built from listings if not given) when numpy is installed,
+    and otherwise ranks each profile with a heap in Python.
+    """
+    profiles = [filters or {} for filters in profiles]
+    if not columnar.available():
+        return [rank_and_sort_all_features(listings, filters, limit=k) for filters in profiles]
+    if columns is None:
+        columns = columnar.ListingColumns(listings)
+    return [[listings[row_id] for row_id in rows.tolist()] for rows in BatchRanker(columns).top_k(profiles, k)]
+
+
+def write_digest(output: IO[str], profiles: Iterable[Profile], results: Iterable[List]):
+    """One JSON line per profile with its ranked listings."""
+    for (profile_id, _), listings in zip(profiles, results):
+        output.write(json.dumps({"id": profile_id, "listings": [listing.to_dict() for listing in listings]}) + "\n")
+
+
+def main(profiles_path: str, csv_filename: str, k: int):
+    with open(profiles_path, encoding='utf-8') as file:
+        profiles = read_profiles(file.read())
+    # The snapshot leaves out deleted listings and maps its columns without parsing
+    snapshot = load_snapshot(csv_filename)
+    columns = columnar.ListingColumns.from_snapshot(snapshot) if columnar.available() else None
+    results = rank_profiles(snapshot, [filters for _, filters in profiles], k, columns)
+    write_digest(sys.stdout, profiles, results)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python batch_ranking.py profiles.(ndjson|json) [user_data.csv] [k]")
+        sys.exit(1)
+    main(sys.argv[1],
+         sys.argv[2] if len(sys.argv) > 2 else 'nwhack25/user_data.csv',
+         int(sys.argv[3]) if len(sys.argv) > 3 else 10)
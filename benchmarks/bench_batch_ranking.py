@@ -0,0 +1,97 @@
+"""Compare batch ranking of many profiles with ranking them one at a time.
+
+Every profile's top k from the batch is checked against the one-at-a-time
+NumPy ranking of the same snapshot.
+
+Usage: python benchmarks/bench_batch_ranking.py [rows] [profiles] [k]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import columnar  # noqa: E402
+from batch_ranking import BatchRanker  # noqa: E402
+from listing import Location  # noqa: E402
+from ranking import rank_and_sort_all_features  # noqa: E402
+from snapshot import compile_snapshot, Snapshot  # noqa: E402
+from synthetic import write_csv  # noqa: E402
+
+# Profiles only compared with the Python ranking, which is much slower
+PYTHON_PROFILES = 20
+
+
+def random_profiles(n: int, seed: int = 0):
+    """Stored preference profiles, with the predicates a digest subscriber would pick."""
+    rng = random.Random(seed)
+    choices = {
+        "max_cst": lambda: rng.randrange(800, 3000, 100),
+        "location": lambda: rng.random() < 0.5,
+        "min_rooms": lambda: rng.randint(1, 4),
+        "max_ppl": lambda: rng.randint(1, 4),
+        "laundry": lambda: True,
+        "parking": lambda: rng.random() < 0.5,
+        "pets": lambda: rng.random() < 0.5,
+        "floor": lambda: rng.choice(["bottom", "middle", "top"]),
+        "gender": lambda: rng.choice(["Female", "Male", "No preference"]),
+        "min_lease_months": lambda: rng.choice([2, 4, 8, 12]),
+    }
+    locations = [location.value for location in Location]
+    profiles = []
+    for _ in range(n):
+        fields = rng.sample(sorted(choices), rng.randint(1, 5))
+        profile = {field: choices[field]() for field in fields}
+        if rng.random() < 0.3:
+            profile["near"] = rng.choice(locations)
+            if rng.random() < 0.5:
+                profile["within_km"] = rng.choice([1, 2, 5])
+        profiles.append(profile)
+    return profiles
+
+
+def main(rows: int, count: int, k: int):
+    if not columnar.available():
+        print("bench_batch_ranking needs numpy installed")
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "listings.csv")
+        write_csv(path, rows)
+        snapshot = Snapshot(compile_snapshot(path))
+        columns = columnar.ListingColumns.from_snapshot(snapshot)
+        profiles = random_profiles(count)
+
+        start = time.perf_counter()
+        expected = [columns.order(filters)[:k] for filters in profiles]
+        one_at_a_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = BatchRanker(columns).top_k(profiles, k)
+        batch = time.perf_counter() - start
+
+        for filters, want, got in zip(profiles, expected, actual):
+            assert want.tolist() == got.tolist(), f"batch top {k} differs for {filters}"
+        print(f"{rows} listings, {count} profiles, top {k}")
+        print(f"  one at a time: {one_at_a_time * 1000:8.0f} ms, {count / one_at_a_time:8.0f} profiles/s")
+        print(f"  batch:         {batch * 1000:8.0f} ms, {count / batch:8.0f} profiles/s, "
+              f"{one_at_a_time / batch:.1f}x")
+
+        # The pure Python path, on a few profiles
+        listings = list(snapshot)
+        sample = profiles[:PYTHON_PROFILES]
+        start = time.perf_counter()
+        python = [rank_and_sort_all_features(listings, filters, limit=k) for filters in sample]
+        elapsed = time.perf_counter() - start
+        for filters, want, got in zip(sample, expected, python):
+            assert [snapshot[row_id].to_dict() for row_id in want.tolist()] == [listing.to_dict() for listing in got], \
+                f"Python ranking differs for {filters}"
+        print(f"  python heap:   {elapsed / len(sample) * count * 1000:8.0f} ms (extrapolated), "
+              f"{len(sample) / elapsed:8.0f} profiles/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 10)
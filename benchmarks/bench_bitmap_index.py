@@ -0,0 +1,59 @@
+"""Compare bitmap-index filtering with a linear scan over to_dict() rows.
+
+Usage: python benchmarks/bench_bitmap_index.py [rows ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from listing_index import ListingIndex  # noqa: E402
+from synthetic import generate_listings  # noqa: E402
+
+QUERIES = [
+    {"location": True, "laundry": True},
+    {"gender": "Female", "floor": "top", "pets": False},
+    {"location": False, "parking": True, "rooms": 2},
+    {"laundry": True, "parking": True, "pets": True, "floor": "bottom", "cst": 1200},
+]
+
+
+def linear_scan(listings, filters):
+    # The scan /listings ran before the bitmap index
+    def match_filter(row, wanted):
+        for key, value in wanted.items():
+            if value is not None and row[key] != value:
+                return False
+        return True
+
+    return [listing for listing in listings if match_filter(listing.to_dict(), filters)]
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(sizes):
+    for n in sizes:
+        listings = generate_listings(n)
+        start = time.perf_counter()
+        index = ListingIndex(listings)
+        build = time.perf_counter() - start
+        print(f"{n} listings, index built in {build * 1000:.1f} ms")
+        for filters in QUERIES:
+            scan_time, expected = timed(lambda: linear_scan(listings, filters))
+            index_time, actual = timed(lambda: index.filter(filters))
+            assert actual == expected, filters
+            print(f"  {filters}: scan {scan_time * 1000:.1f} ms, "
+                  f"bitmap {index_time * 1000:.1f} ms, {len(actual)} rows, "
+                  f"{scan_time / index_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 300_000])
@@ -0,0 +1,41 @@
+"""Compare the NumPy columnar ranking engine with the pure-Python ranking.
+
+Usage: python benchmarks/bench_columnar_ranking.py [rows ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from columnar import ListingColumns  # noqa: E402
+from ranking import rank_and_sort_all_features  # noqa: E402
+from synthetic import generate_listings  # noqa: E402
+
+FILTERS = {"max_cst": 1500, "location": True, "min_rooms": 2, "laundry": True, "floor": "top"}
+
+
+def main(sizes):
+    for n in sizes:
+        listings = generate_listings(n)
+
+        start = time.perf_counter()
+        expected = rank_and_sort_all_features(listings, FILTERS)
+        python_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        columns = ListingColumns(listings)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = columns.rank(FILTERS)
+        numpy_time = time.perf_counter() - start
+
+        assert actual == expected, "columnar order differs from the Python ranking"
+        print(f"{n} listings: python {python_time * 1000:.0f} ms, "
+              f"numpy {numpy_time * 1000:.0f} ms (+{build_time * 1000:.0f} ms to build columns), "
+              f"{python_time / numpy_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -0,0 +1,112 @@
+"""Report bytes per listing for the old record types and the shared Listing.
+
+Usage: python benchmarks/bench_listing_memory.py [rows]
+"""
+import csv
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from typing import NamedTuple, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from listing import FloorPreference, Listing  # noqa: E402
+from synthetic import write_csv  # noqa: E402
+
+
+class DictUserData:
+    """The old test1.py record: a plain class with a per-instance __dict__."""
+
+    def __init__(self, cst, location, descr, rooms, ppl, length, laundry, parking, gender, floor, pets):
+        self.cst = cst
+        self.location = location
+        self.descr = descr
+        self.rooms = rooms
+        self.ppl = ppl
+        self.length = length
+        self.laundry = laundry
+        self.parking = parking
+        self.gender = gender
+        self.floor = floor
+        self.pets = pets
+
+
+class TupleUserData(NamedTuple):
+    """The old 'UBC Sublet.py' record."""
+    cst: int
+    location: bool
+    descr: Optional[str]
+    rooms: Optional[int]
+    ppl: Optional[int]
+    length: Optional[str]
+    laundry: Optional[bool]
+    parking: Optional[bool]
+    gender: Optional[str]
+    floor: Optional[FloorPreference]
+    pets: Optional[bool]
+
+
+def old_fields(row):
+    # Parsing as the old readers did: every string is a fresh copy from csv
+    def parse_bool(value):
+        return value.lower() == 'true' if value else None
+
+    return dict(
+        cst=int(row['cst']) if row['cst'] else None,
+        location=parse_bool(row['location']),
+        descr=row.get('descr'),
+        rooms=int(row['rooms']) if row['rooms'] else None,
+        ppl=int(row['ppl']) if row['ppl'] else None,
+        length=row.get('length'),
+        laundry=parse_bool(row['laundry']),
+        parking=parse_bool(row['parking']),
+        gender=row.get('gender'),
+        floor=FloorPreference[row['floor'].upper()] if row.get('floor') else None,
+        pets=parse_bool(row['pets']),
+    )
+
+
+def measure(path, make):
+    gc.collect()
+    tracemalloc.start()
+    with open(path, newline='', encoding='utf-8') as file:
+        records = [make(row) for row in csv.DictReader(file)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / len(records), records
+
+
+def main(n):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'listings.csv')
+        write_csv(path, n)
+        print(f"{n} listings")
+        results = [
+            ("test1 dict class (before)", lambda row: DictUserData(**old_fields(row))),
+            ("NamedTuple (before)", lambda row: TupleUserData(**old_fields(row))),
+            ("Listing (after)", Listing.from_row),
+        ]
+        for name, make in results:
+            per_listing, records = measure(path, make)
+            print(f"  {name:28} {per_listing:7.0f} bytes/listing")
+            del records
+
+        try:
+            from columnar import ListingColumns
+            with open(path, newline='', encoding='utf-8') as file:
+                listings = [Listing.from_row(row) for row in csv.DictReader(file)]
+            gc.collect()
+            tracemalloc.start()
+            columns = ListingColumns(listings)
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  {'+ NumPy columns':28} {current / n:7.0f} bytes/listing")
+            del columns
+        except RuntimeError:
+            pass
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
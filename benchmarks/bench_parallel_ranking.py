@@ -0,0 +1,63 @@
+"""Measure how sharded ranking in a process pool scales with the number of workers.
+
+Every run is checked against the sequential ranking of the same snapshot.
+
+Usage: python benchmarks/bench_parallel_ranking.py [rows] [max workers]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import columnar  # noqa: E402
+from parallel_ranking import ShardedRanker  # noqa: E402
+from snapshot import compile_snapshot, Snapshot  # noqa: E402
+from synthetic import write_csv  # noqa: E402
+
+FILTERS = {"max_cst": 1500, "location": True, "min_rooms": 2, "laundry": True, "floor": "top"}
+REPEAT = 5
+
+
+def best_of(fn) -> float:
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(rows: int, max_workers: int):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "listings.csv")
+        write_csv(path, rows)
+        snapshot = Snapshot(compile_snapshot(path))
+
+        if columnar.available():
+            columns = columnar.ListingColumns.from_snapshot(snapshot)
+            expected = columns.order(FILTERS, 20).tolist()
+            sequential = best_of(lambda: columns.order(FILTERS, 20))
+            print(f"{rows} listings, sequential numpy: {sequential * 1000:.0f} ms")
+        else:
+            sequential = None
+            expected = None
+
+        workers = 1
+        while workers <= max_workers:
+            ranker = ShardedRanker(workers, min_shard_rows=1)
+            actual = ranker.order(snapshot, FILTERS, limit=20)  # Also starts the pool
+            if expected is None:
+                expected = actual
+            assert actual == expected, "sharded order differs from the sequential ranking"
+            elapsed = best_of(lambda: ranker.order(snapshot, FILTERS, limit=20))
+            ranker.close()
+            speedup = f", {sequential / elapsed:.2f}x sequential" if sequential else ""
+            print(f"{workers:3} workers: top 20 in {elapsed * 1000:.0f} ms{speedup}")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1)
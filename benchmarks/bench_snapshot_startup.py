@@ -0,0 +1,45 @@
+"""Compare startup cost of parsing user_data.csv with opening its snapshot.
+
+Usage: python benchmarks/bench_snapshot_startup.py [rows ...]
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from listing import Listing  # noqa: E402
+from snapshot import Snapshot, compile_snapshot  # noqa: E402
+from synthetic import write_csv  # noqa: E402
+
+
+def main(sizes):
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            path = os.path.join(directory, f"listings_{n}.csv")
+            write_csv(path, n)
+
+            start = time.perf_counter()
+            with open(path, newline='', encoding='utf-8') as file:
+                listings = [Listing.from_row(row) for row in csv.DictReader(file)]
+            parse_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            snapshot_file = compile_snapshot(path)
+            compile_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            snapshot = Snapshot(snapshot_file)
+            cst = snapshot.view("cst")
+            open_time = time.perf_counter() - start
+
+            assert len(snapshot) == len(listings) and cst[n - 1] == listings[-1].cst
+            print(f"{n} listings: parse CSV {parse_time * 1000:.0f} ms, "
+                  f"compile snapshot {compile_time * 1000:.0f} ms, "
+                  f"open snapshot {open_time * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
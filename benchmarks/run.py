@@ -0,0 +1,188 @@
+"""Benchmark harness for the ingest, filter, rank and post paths.
+
+Every path runs on synthetic data from synthetic.py and reports throughput,
+p50/p99 latency and peak traced memory. Results can be saved as JSON and
+compared against an earlier run to catch regressions.
+
+Usage:
+    python benchmarks/run.py [--sizes 1000,10000,100000,1000000] [--repeat 5]
+                             [--json results.json] [--baseline old.json] [--fsync]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from listing import LISTING_FIELDS, Listing  # noqa: E402
+from listing_index import ListingIndex, predicate_matches  # noqa: E402
+from listing_store import CsvLoader  # noqa: E402
+from post_writer import GroupCommitWriter  # noqa: E402
+from ranking import rank_and_sort_all_features  # noqa: E402
+from snapshot import compile_snapshot, load_snapshot  # noqa: E402
+from synthetic import generate_rows, write_csv  # noqa: E402
+
+import columnar  # noqa: E402
+
+QUERIES = [
+    {"location": True, "laundry": True},
+    {"gender": "Female", "floor": "top", "pets": False},
+    {"max_cst": 1500, "min_rooms": 2, "parking": True},
+    {"laundry": True, "parking": True, "pets": True, "floor": "bottom", "max_cst": 1200},
+]
+
+RANK_FILTERS = {"max_cst": 1500, "location": True, "min_rooms": 2, "laundry": True, "floor": "top"}
+
+# A p50 this much slower than the baseline is reported as a regression
+REGRESSION_FACTOR = 1.2
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def peak_memory(fn: Callable) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(fn: Callable, repeat: int, items: int) -> Dict[str, float]:
+    """Time fn repeat times; items is how many rows or posts one call handles."""
+    peak = peak_memory(fn)  # Also serves as the warm-up run
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return {
+        "throughput": items / statistics.mean(latencies),
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_bytes": peak,
+    }
+
+
+def bench_posts(directory: str, posts: int, threads: int, fsync: bool) -> Dict[str, float]:
+    """Concurrent add_post-style appends through the group-commit writer."""
+    path = os.path.join(directory, f"posts_{threads}.csv")
+    writer = GroupCommitWriter(path, LISTING_FIELDS, fsync=fsync)
+    rows = list(generate_rows(posts, seed=1))
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def worker(chunk):
+        for row in chunk:
+            start = time.perf_counter()
+            writer.submit(row)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(rows[i::threads],)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    writer.close()
+    return {
+        "throughput": posts / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_bytes": peak,
+    }
+
+
+def run(sizes: List[int], repeat: int, fsync: bool) -> Dict[str, Dict[str, float]]:
+    results = {}
+    loader = CsvLoader(Listing.from_row)
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            path = os.path.join(directory, f"listings_{n}.csv")
+            write_csv(path, n)
+            listings = loader(path)
+            index = ListingIndex(listings)
+            compile_snapshot(path)
+
+            paths = {
+                "ingest/csv": (lambda: loader(path), n),
+                "ingest/snapshot_open": (lambda: load_snapshot(path), n),
+                "index/build": (lambda: ListingIndex(listings), n),
+                "filter/scan": (lambda: [
+                    [listing for listing in listings
+                     if all(predicate_matches(listing, key, value) for key, value in query.items())]
+                    for query in QUERIES
+                ], n * len(QUERIES)),
+                "filter/index": (lambda: [index.filter(query) for query in QUERIES], n * len(QUERIES)),
+                "rank/full_sort": (lambda: rank_and_sort_all_features(listings, RANK_FILTERS), n),
+                "rank/top20": (lambda: rank_and_sort_all_features(listings, RANK_FILTERS, limit=20), n),
+            }
+            if columnar.available():
+                columns = columnar.ListingColumns(listings)
+                paths["rank/numpy"] = (lambda: columns.rank(RANK_FILTERS, limit=20), n)
+
+            for name, (fn, items) in paths.items():
+                results[f"{name}@{n}"] = measure(fn, repeat, items)
+                print_result(f"{name}@{n}", results[f"{name}@{n}"])
+
+        for threads in (1, 8):
+            name = f"post/threads={threads}"
+            results[name] = bench_posts(directory, 2000, threads, fsync)
+            print_result(name, results[name])
+    return results
+
+
+def print_result(name: str, result: Dict[str, float]):
+    print(f"{name:32} {result['throughput']:>14,.0f}/s  p50 {result['p50_ms']:9.2f} ms  "
+          f"p99 {result['p99_ms']:9.2f} ms  peak {result['peak_bytes'] / 2 ** 20:8.1f} MiB")
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before and result["p50_ms"] > before["p50_ms"] * REGRESSION_FACTOR:
+            regressions.append(f"{name}: p50 {before['p50_ms']:.2f} ms -> {result['p50_ms']:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated row counts, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against results saved with --json")
+    parser.add_argument("--fsync", action="store_true", help="fsync every group commit in the post benchmark")
+    args = parser.parse_args()
+
+    results = run([int(size) for size in args.sizes.split(",")], args.repeat, args.fsync)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file))
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
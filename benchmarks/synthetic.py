@@ -0,0 +1,89 @@
+"""Seeded generator of realistic user_data.csv rows.
+
+Usage: python benchmarks/synthetic.py rows output.csv [seed]
+"""
+import csv
+import os
+import random
+import sys
+from typing import Dict, Iterator, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from listing import LISTING_FIELDS, Listing, Location  # noqa: E402
+
+MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+          "August", "September", "October", "November", "December"]
+SHORT_MONTHS = [month[:3] for month in MONTHS]
+
+DESCRIPTION_PARTS = [
+    "Ocean View!", "Spacious house with a large backyard.", "Nice apartment with a park view.",
+    "very spacious apartment for rent, friendly neighbors", "Good neighbors, Near bus",
+    "Quiet street", "Close to campus", "Newly renovated kitchen", "Furnished room",
+    "Shared bathroom", "Utilities included", "Walking distance to the beach",
+]
+
+# Share of rows that leave an optional column blank
+BLANK_RATE = {
+    "descr": 0.15, "rooms": 0.1, "ppl": 0.35, "length": 0.2, "laundry": 0.3,
+    "parking": 0.3, "gender": 0.5, "floor": 0.5, "pets": 0.3,
+}
+
+
+def random_lease(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.35:
+        return f"{rng.choice([2, 3, 4, 5, 6, 8, 12])} months" + rng.choice(["", " lease"])
+    if kind < 0.55:
+        return f"{rng.choice([1, 2])} year" + rng.choice(["", " lease"])
+    if kind < 0.75:
+        return f"{rng.choice([4, 8, 12, 16])} weeks"
+    start, end = rng.randrange(12), rng.randrange(12)
+    return (f"From {rng.choice([SHORT_MONTHS, MONTHS])[start]} {rng.randint(1, 28)} "
+            f"to {MONTHS[end]} {rng.randint(1, 28)}")
+
+
+def generate_rows(n: int, seed: int = 0) -> Iterator[Dict[str, str]]:
+    """Yield n CSV rows (all values as strings) with the same shapes as user_data.csv.
+
+    Location is a Location name for most rows and the True/False written by
+    the API for the rest; optional columns are blank at BLANK_RATE.
+    """
+    rng = random.Random(seed)
+    locations = [location.value for location in Location]
+    for _ in range(n):
+        row = {
+            "cst": str(rng.randrange(600, 3500, 50)),
+            "location": rng.choice(locations) if rng.random() < 0.6 else rng.choice(["True", "False"]),
+            "descr": " ".join(rng.sample(DESCRIPTION_PARTS, rng.randint(1, 3))),
+            "rooms": str(rng.choice([1, 1, 2, 2, 3, 4, 5])),
+            "ppl": str(rng.choice([1, 1, 2, 3, 4])),
+            "length": random_lease(rng),
+            "laundry": rng.choice(["True", "False"]),
+            "parking": rng.choice(["True", "False"]),
+            "gender": rng.choice(["Male", "Female", "No preference", "male", "female"]),
+            "floor": rng.choice(["bottom", "middle", "top"]),
+            "pets": rng.choice(["True", "False"]),
+        }
+        for field, rate in BLANK_RATE.items():
+            if rng.random() < rate:
+                row[field] = ""
+        yield row
+
+
+def write_csv(path: str, n: int, seed: int = 0):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=LISTING_FIELDS)
+        writer.writeheader()
+        writer.writerows(generate_rows(n, seed))
+
+
+def generate_listings(n: int, seed: int = 0) -> List[Listing]:
+    return [Listing.from_row(row) for row in generate_rows(n, seed)]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python benchmarks/synthetic.py rows output.csv [seed]")
+        sys.exit(1)
+    write_csv(sys.argv[2], int(sys.argv[1]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)
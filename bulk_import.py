@@ -0,0 +1,167 @@
+"""Validate many posted listings at once and append them in one write.
+
+Used by POST /add_posts in test1.py, and from the command line to migrate
+listings exported from another board:
+
+    python bulk_import.py listings.ndjson [nwhack25/user_data.csv] [flag|merge|off]
+
+The input can be NDJSON (one object per line), a JSON array, or a CSV with a
+header row. Invalid records are reported with their position and skipped;
+all valid ones go to the file in a single append. Re-posts of listings
+already in the file are flagged, or merged, by duplicates.py.
+"""
+import csv
+import io
+import json
+import sys
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import duplicates
+from listing import parse_place
+from listing_store import get_store
+
+# (position of the record in the input, error message)
+RowError = Tuple[int, str]
+
+
+def _flag(value) -> bool:
+    # JSON clients may send real booleans instead of "true"/"false", and CSV
+    # exports from the CLI scripts hold yes/no, as in listing.parse_bool
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('true', 'yes')
+
+
+def _location(value):
+    # A Location name is kept as written, so the listing keeps its geo place
+    if isinstance(value, str) and parse_place(value) is not None:
+        return value.strip()
+    return _flag(value)
+
+
+def parse_post(data: dict) -> dict:
+    """Validate one posted listing and turn it into a user_data.csv row.
+
+    Raises ValueError with a readable message for a record that can't be used.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    # Blank CSV cells mean the field was left out
+    data = {key: value for key, value in data.items() if value is not None and value != ''}
+    for field in ('cst', 'location'):
+        if field not in data:
+            raise ValueError(f"missing required field {field!r}")
+    try:
+        return {
+            "cst": int(data['cst']),
+            "location": _location(data['location']),
+            "descr": data.get('descr', ''),
+            "rooms": int(data['rooms']) if 'rooms' in data else None,
+            "ppl": int(data['ppl']) if 'ppl' in data else None,
+            "length": data.get('length', ''),
+            "laundry": _flag(data['laundry']) if 'laundry' in data else None,
+            "parking": _flag(data['parking']) if 'parking' in data else None,
+            "gender": data.get('gender', ''),
+            "floor": str(data['floor']).upper() if 'floor' in data else None,
+            "pets": _flag(data['pets']) if 'pets' in data else None
+        }
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid value: {e}") from None
+
+
+def read_records(text: str, format: Optional[str] = None) -> Iterator[Tuple[int, object]]:
+    """Yield (position, record) for NDJSON, a JSON array or CSV text.
+
+    Without a format it is guessed: '[' starts a JSON array, '{' NDJSON, and
+    anything else is CSV. NDJSON lines that aren't valid JSON, and CSV rows
+    with more or fewer cells than the header, are yielded as the exception so
+    they are reported like any other bad record.
+    """
+    if format is None:
+        start = text.lstrip()[:1]
+        format = "json" if start == "[" else "ndjson" if start == "{" else "csv"
+    if format == "json":
+        records = json.loads(text)
+        if not isinstance(records, list):
+            raise ValueError("expected a JSON array of listings")
+        yield from enumerate(records)
+    elif format == "ndjson":
+        position = 0
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                yield position, json.loads(line)
+            except ValueError as e:
+                yield position, ValueError(f"invalid JSON: {e}")
+            position += 1
+    elif format == "csv":
+        for position, row in enumerate(csv.DictReader(io.StringIO(text, newline=''))):
+            if None in row or None in row.values():
+                yield position, ValueError("wrong number of cells for the header")
+            else:
+                yield position, row
+    else:
+        raise ValueError(f"unknown format {format!r}")
+
+
+def validate_posts(records: Iterable[Tuple[int, object]]) -> Tuple[List[dict], List[RowError]]:
+    """Split records into valid CSV rows and per-record errors."""
+    rows = []
+    errors = []
+    for position, record in records:
+        try:
+            if isinstance(record, Exception):
+                raise record
+            rows.append(parse_post(record))
+        except ValueError as e:
+            errors.append((position, str(e)))
+    return rows, errors
+
+
+def number_reports(records: List[Tuple[int, object]], errors: List[RowError],
+                   reports: List[Tuple[int, dict]]) -> List[dict]:
+    """duplicates.append_posts reports, numbered by input record instead of by valid row."""
+    invalid = {position for position, _ in errors}
+    positions = [position for position, _ in records if position not in invalid]
+    numbered = []
+    for row, report in reports:
+        report = {key: [positions[i] for i in value] if key.endswith("_index") else value
+                  for key, value in report.items()}
+        numbered.append(dict(report, index=positions[row]))
+    return numbered
+
+
+def import_posts(filename: str, records: Iterable[Tuple[int, object]],
+                 mode: str = duplicates.FLAG) -> Tuple[int, List[RowError], List[dict]]:
+    """Append every valid record to filename in one write.
+
+    Returns (added, errors, duplicate reports numbered by record).
+    """
+    records = list(records)
+    rows, errors = validate_posts(records)
+    if not rows:
+        return 0, errors, []
+    added, reports = duplicates.append_posts(get_store(filename, duplicates.read_listings), rows, mode)
+    return added, errors, number_reports(records, errors, reports)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python bulk_import.py listings.(ndjson|json|csv) [user_data.csv] [flag|merge|off]")
+        sys.exit(1)
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) > 2 else 'nwhack25/user_data.csv'
+    mode = sys.argv[3] if len(sys.argv) > 3 else duplicates.FLAG
+    with open(source, encoding='utf-8') as file:
+        text = file.read()
+    extension = source.rsplit('.', 1)[-1].lower()
+    added, errors, reports = import_posts(
+        target, read_records(text, extension if extension in ("ndjson", "json", "csv") else None), mode)
+    for position, message in errors:
+        print(f"record {position}: {message}")
+    for report in reports:
+        details = ", ".join(f"{key} {value}" for key, value in report.items() if key != "index")
+        print(f"record {report['index']}: {details}")
+    print(f"Added {added} listings to {target}, skipped {len(errors)}")
+    sys.exit(1 if errors and not added else 0)
@@ -0,0 +1,402 @@
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional
+
+import geo
+from listing_index import field_value, parse_range_key, plain_value, predicate_matches
+from ranking import SORT_ORDER, lease_months, sort_order_for
+
+try:
+    import numpy as np
+except ImportError:  # The columnar engine is optional; ranking.py works without it
+    np = None
+
+
+# Range fields parsed from the length text; columns so lease filters don't fall back to a Python scan
+LEASE_FIELDS = ["lease_months", "lease_start", "lease_end"]
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _appended(array: "np.ndarray", value, spare: Dict[str, "np.ndarray"], name: str) -> "np.ndarray":
+    """array with value added at the end.
+
+    The result is a view of a buffer, kept in spare[name], with room for as
+    many rows again, so appending is amortized constant time. Rows already in
+    the array are never written, so views taken from it before stay valid.
+    """
+    size = len(array)
+    buffer = spare.get(name)
+    if buffer is None or array.base is not buffer or size == len(buffer):
+        buffer = spare[name] = np.empty(max(16, 2 * size), dtype=array.dtype)
+        buffer[:size] = array
+    buffer[size] = value
+    return buffer[:size + 1]
+
+
+def _sorted_order(categories: List) -> tuple:
+    # Rank of each code among the sorted values, and -1 after them for None (code -1)
+    return categories, np.append(np.arange(len(categories), dtype=np.int32), np.int32(-1))
+
+
+class Column:
+    """One listing field as a NumPy array.
+
+    Numbers and booleans are stored as float64 with NaN for None. Anything
+    else (strings, enums) is dictionary-encoded with None as -1. order holds
+    the distinct values sorted and the rank of each code among them, so
+    comparing ranks orders rows the same way comparing the values does.
+    Values first seen by append() get the next free code, so existing rows
+    are never renumbered.
+    """
+
+    def __init__(self, values: List):
+        present = [value for value in values if value is not None]
+        self.numeric = all(isinstance(value, (bool, int, float)) for value in present)
+        self._spare: Dict[str, "np.ndarray"] = {}
+        if self.numeric:
+            self.categories = []
+            self.codes = {}
+            self.data = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        else:
+            self.categories = sorted(set(present))
+            self.codes = {value: code for code, value in enumerate(self.categories)}
+            self.data = np.array([-1 if value is None else self.codes[value] for value in values], dtype=np.int32)
+        self.order = _sorted_order(list(self.categories))
+
+    @classmethod
+    def from_array(cls, data, categories: Optional[List] = None) -> "Column":
+        """Wrap an existing array, e.g. one mapped from a snapshot, without copying it.
+
+        Codes must follow the sorted order of categories, as in a snapshot.
+        """
+        column = cls.__new__(cls)
+        column.numeric = categories is None
+        column.categories = list(categories or [])
+        column.codes = {value: code for code, value in enumerate(column.categories)}
+        column.order = _sorted_order(list(column.categories))
+        column.data = data
+        column._spare = {}
+        return column
+
+    def view(self, start: int, stop: Optional[int]) -> "Column":
+        """Rows start..stop, sharing the data and the dictionary."""
+        column = Column.__new__(Column)
+        column.numeric = self.numeric
+        column.categories = self.categories
+        column.codes = self.codes
+        column.order = self.order
+        column.data = self.data[start:stop]
+        column._spare = {}
+        return column
+
+    def append(self, value) -> bool:
+        """Add a row; False if the value doesn't fit the column, which must then be rebuilt."""
+        if value is None:
+            self.data = _appended(self.data, np.nan if self.numeric else -1, self._spare, "data")
+            return True
+        if self.numeric:
+            if not isinstance(value, (bool, int, float)):
+                return False
+            self.data = _appended(self.data, value, self._spare, "data")
+            return True
+        code = self.codes.get(value)
+        if code is None:
+            values, ranks = self.order
+            try:
+                position = bisect_left(values, value)
+            except TypeError:
+                return False
+            code = len(self.categories)
+            ranks = ranks[:-1]
+            # Replaced, never changed in place: readers may hold the old order
+            self.order = (values[:position] + [value] + values[position:],
+                          np.concatenate([ranks + (ranks >= position), [position, -1]]).astype(np.int32))
+            self.categories.append(value)
+            self.codes[value] = code
+        self.data = _appended(self.data, code, self._spare, "data")
+        return True
+
+    def equals(self, value) -> "np.ndarray":
+        if self.numeric:
+            if not isinstance(value, (bool, int, float)):
+                return np.zeros(len(self.data), dtype=bool)
+            return self.data == value
+        code = self.codes.get(value)
+        if code is None:
+            return np.zeros(len(self.data), dtype=bool)
+        return self.data == code
+
+    def in_range(self, bound: str, value) -> Optional["np.ndarray"]:
+        """Rows >= value for a "min" bound, <= value for "max"; None if the values can't be compared."""
+        if self.numeric:
+            if not isinstance(value, (int, float)):
+                return None
+            # NaN (None) fails both comparisons, as in predicate_matches
+            return self.data >= value if bound == "min" else self.data <= value
+        values, ranks = self.order
+        try:
+            if bound == "min":
+                return ranks[self.data] >= bisect_left(values, value)
+            positions = ranks[self.data]
+            return (positions >= 0) & (positions < bisect_right(values, value))
+        except TypeError:
+            return None
+
+    def sort_values(self, none_value: float) -> "np.ndarray":
+        """Values for sorting, with None replaced by none_value (+/-inf)."""
+        if self.numeric:
+            return np.where(np.isnan(self.data), none_value, self.data)
+        ranks = self.order[1]
+        return np.where(self.data < 0, none_value, ranks[self.data].astype(np.float64))
+
+
+class RowRange:
+    """Rows start..stop of a list of listings (or a snapshot), without copying them."""
+
+    def __init__(self, listings, start: int, stop: int):
+        self.listings = listings
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, row: int):
+        if not 0 <= row < len(self):
+            raise IndexError("row out of range")
+        return self.listings[self.start + row]
+
+    def __iter__(self):
+        for row in range(self.start, self.stop):
+            yield self.listings[row]
+
+
+def top_rows(keys: List["np.ndarray"], k: int, rows: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """The first k row ids of np.lexsort(keys), without sorting every row.
+
+    A linear-time partition on the primary key drops the rows that can't make
+    the top k; the rows tied with the k-th one are narrowed down the same way
+    on the next key. rows, if given, must be in ascending order.
+    """
+    if rows is None:
+        rows = np.arange(len(keys[-1]))
+    if k <= 0:
+        return rows[:0]
+    if not keys:
+        return rows[:k]  # Tied on every key: row order decides, as in the stable lexsort
+    if len(rows) > k:
+        primary = keys[-1][rows]
+        threshold = np.partition(primary, k - 1)[k - 1]
+        ahead = rows[primary < threshold]
+        tied = top_rows(keys[:-1], k - len(ahead), rows[primary == threshold])
+        rows = np.sort(np.concatenate([ahead, tied]))
+    return rows[np.lexsort([key[rows] for key in keys])][:k]
+
+
+class ListingColumns:
+    """Struct-of-arrays copy of the listings used to score and order them with NumPy.
+
+    rank() returns the same listings, in the same order, as
+    ranking.rank_and_sort_all_features over the rows that weren't removed.
+
+    Works as a ListingStore derived structure: add() and remove() keep it in
+    step with appended and deleted rows, in amortized constant time per row.
+    order() and rank() work on a view of the rows taken under a lock, so they
+    can run while rows are added.
+    """
+
+    def __init__(self, listings: List):
+        if np is None:
+            raise RuntimeError("The columnar ranking engine needs numpy installed")
+        self.listings = listings
+        self.columns: Dict[str, Column] = {
+            field: Column([field_value(listing, field) for listing in listings])
+            for field in SORT_ORDER + LEASE_FIELDS
+        }
+        # Lease duration in months, as parsed when the listings were loaded
+        self.length_months = np.array(
+            [lease_months(listing) for listing in listings],
+            dtype=np.float64,
+        )
+        # Place of each listing as a geo place id, -1 if it has none
+        self.place_ids = np.array(
+            [-1 if (place := geo.place_id(listing)) is None else place for listing in listings],
+            dtype=np.int16,
+        )
+        self.removed = np.zeros(len(listings), dtype=bool)  # Deleted rows, left out of the ranking
+        self.size = len(listings)  # Rows held; listings may be the store's list, which grows first
+        self._field_keys: Dict[str, "np.ndarray"] = {}
+        self._spare: Dict[str, "np.ndarray"] = {}  # Room to append to the arrays, see _appended
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_snapshot(cls, snapshot) -> "ListingColumns":
+        """Use the columns of a snapshot.Snapshot in place, without parsing any rows.
+
+        The snapshot stores numbers as float64 with NaN and strings as codes
+        into a sorted dictionary, which is the layout Column uses.
+        """
+        if np is None:
+            raise RuntimeError("The columnar ranking engine needs numpy installed")
+        columns = cls.__new__(cls)
+        columns.listings = snapshot
+        columns.columns = {}
+        for field in SORT_ORDER + LEASE_FIELDS:
+            entry = snapshot.columns[field]
+            categories = snapshot.categories(field) if "categories" in entry else None
+            columns.columns[field] = Column.from_array(snapshot.array(field), categories)
+        columns.length_months = snapshot.array("length_months")
+        columns.place_ids = snapshot.array("place_id")
+        columns.removed = np.zeros(len(snapshot), dtype=bool)
+        columns.size = len(snapshot)
+        columns._field_keys = {}
+        columns._spare = {}
+        columns._lock = threading.Lock()
+        return columns
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, row_id: int, listing):
+        """Append the row after the last one held."""
+        with self._lock:
+            for field, column in list(self.columns.items()):
+                order = column.order
+                value = field_value(listing, field)
+                if not column.append(value):
+                    # The first value of another type: parse the column again
+                    column = self.columns[field] = Column(
+                        [field_value(self.listings[row], field) for row in range(row_id)] + [value])
+                if column.order is not order:
+                    self._field_keys.pop(field, None)  # The ranks of its values moved
+            self.length_months = _appended(self.length_months, lease_months(listing), self._spare, "length_months")
+            place = geo.place_id(listing)
+            self.place_ids = _appended(self.place_ids, -1 if place is None else place, self._spare, "place_ids")
+            self.removed = _appended(self.removed, False, self._spare, "removed")
+            for field, key in list(self._field_keys.items()):
+                self._field_keys[field] = _appended(key, self._key(field, row_id)[0], self._spare, "key " + field)
+            self.size = row_id + 1
+
+    def remove(self, row_id: int, listing):
+        with self._lock:
+            self.removed[row_id] = True
+
+    def _matches(self, key: str, value) -> "np.ndarray":
+        range_key = parse_range_key(key)
+        if range_key is not None:
+            field, bound = range_key
+            column = self.columns.get(field)
+            if column is not None:
+                matches = column.in_range(bound, value)
+                if matches is not None:
+                    return matches
+        else:
+            column = self.columns.get(key)
+            if column is not None:
+                return column.equals(plain_value(value))
+        # Fields without a column fall back to the per-row check
+        return np.fromiter(
+            (predicate_matches(listing, key, value) for listing in self.listings),
+            dtype=bool, count=self.size,
+        )
+
+    def fitness(self, filters: dict) -> "np.ndarray":
+        """Number of filter predicates each listing satisfies."""
+        filters, geo_query = geo.split_filters(filters)
+        score = np.zeros(self.size, dtype=np.int64)
+        for key, value in filters.items():
+            if value is not None:
+                score += self._matches(key, value)
+        if geo_query is not None and geo_query.inside is not None:
+            score += np.isin(self.place_ids, list(geo_query.inside))
+        return score
+
+    def _key(self, field: str, start: int = 0) -> "np.ndarray":
+        if field == "length":
+            return -self.length_months[start:]
+        column = self.columns[field].view(start, None)
+        if field == "cst":
+            return column.sort_values(np.inf)
+        return -column.sort_values(-np.inf)
+
+    def field_key(self, field: str) -> "np.ndarray":
+        """Ascending lexsort key of a field, computed once and shared by every query.
+
+        Cost is ascending with unknown costs last; every other field is
+        negated, so larger values come first and missing ones last.
+        """
+        key = self._field_keys.get(field)
+        if key is None:
+            with self._lock:
+                key = self._field_keys.get(field)
+                if key is None:
+                    key = self._field_keys[field] = self._key(field)
+        return key
+
+    def sort_keys(self, filters: Optional[dict] = None, fitness: Optional["np.ndarray"] = None) -> List["np.ndarray"]:
+        """Keys for np.lexsort, least significant first.
+
+        fitness, if given, is this query's already computed fitness().
+        """
+        filters = filters or {}
+        plain, geo_query = geo.split_filters(filters)
+
+        # The Python key is (fitness, field, ...) sorted in reverse. lexsort
+        # is ascending and stable, so every key is negated (cost already is in
+        # the Python key), which keeps ties in their original order just like
+        # sorted(reverse=True).
+        keys = [self.field_key(field) for field in sort_order_for(plain)][::-1]
+        if geo_query is not None:
+            # Distance follows fitness; -1 picks the trailing inf, so unplaced listings go last
+            distances = np.array(geo_query.distances + [np.inf], dtype=np.float64)
+            keys.append(distances[self.place_ids])
+        # lexsort treats the last key as the primary one
+        return keys + [-(self.fitness(filters) if fitness is None else fitness)]
+
+    def _view(self) -> "ListingColumns":
+        """The rows held now, unaffected by later add() calls."""
+        return self.shard(0, self.size)
+
+    def order(self, filters: Optional[dict] = None, count: Optional[int] = None) -> "np.ndarray":
+        """Row ids in ranked order, leaving out removed rows; only the first count if given."""
+        view = self._view()
+        keys = view.sort_keys(filters)
+        removed = view.removed
+        if count is not None:
+            return top_rows(keys, count, np.flatnonzero(~removed) if removed.any() else None)
+        rows = np.lexsort(keys)
+        return rows[~removed[rows]]
+
+    def shard(self, start: int, stop: int) -> "ListingColumns":
+        """Rows start..stop as their own ListingColumns, sharing the arrays.
+
+        Row ids of the shard start at 0. Dictionary codes are those of the
+        whole set, so keys from different shards can be compared. Taken under
+        the lock, so rows added meanwhile don't show up in some arrays only.
+        """
+        shard = ListingColumns.__new__(ListingColumns)
+        with self._lock:
+            # Computed over every row, so the next shard reuses them
+            for field in SORT_ORDER:
+                if field not in self._field_keys:
+                    self._field_keys[field] = self._key(field)
+            shard.listings = RowRange(self.listings, start, stop)
+            shard.columns = {field: column.view(start, stop) for field, column in self.columns.items()}
+            shard.length_months = self.length_months[start:stop]
+            shard.place_ids = self.place_ids[start:stop]
+            shard.removed = self.removed[start:stop]
+            shard._field_keys = {field: key[start:stop] for field, key in self._field_keys.items()}
+        shard.size = stop - start
+        shard._spare = {}
+        shard._lock = threading.Lock()
+        return shard
+
+    def rank(self, filters: Optional[dict] = None, limit: Optional[int] = None, offset: int = 0) -> List:
+        """Ranked listings, optionally only one page of them."""
+        rows = self.order(filters, None if limit is None else offset + limit)
+        listings = self.listings
+        return [listings[row_id] for row_id in rows[offset:].tolist()]
+
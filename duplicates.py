@@ -0,0 +1,279 @@
+"""Near-duplicate detection for posted listings.
+
+Each listing is fingerprinted with a MinHash signature of the character
+shingles of its description, plus an exact key of its location, rooms and
+floor. The signature is cut into bands, and each band, together with the
+exact key, is a bucket of a locality-sensitive hashing index. A new post is
+only compared with the listings sharing at least one bucket, so checking it
+doesn't depend on how many listings there are. Listings are fingerprinted
+lazily: building the index only groups the rows by exact key, and a group's
+signatures are computed the first time a post with that key is checked, so
+a server's first post or a one-off command-line post doesn't pay for
+fingerprinting every listing. Two listings whose
+descriptions have a Jaccard similarity s share a bucket with probability
+1 - (1 - s**ROWS_PER_BAND)**BANDS: about 0.89 at s = 0.6, almost always
+above 0.8, and 0.12 at s = 0.3.
+
+Candidates count as duplicates when their estimated similarity reaches
+THRESHOLD and their costs differ by at most MAX_COST_CHANGE. Listings
+without a description are never matched.
+
+append_posts() is the ingest step shared by POST /add_post, /add_posts and
+the command-line post scripts. It runs in one of three modes:
+- FLAG writes every post and reports the listings it duplicates.
+- MERGE deletes those listings, so the newest version of a sublet is the one
+  kept.
+- OFF skips the check.
+"""
+import random
+import threading
+import zlib
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import metrics
+from listing import LISTING_FIELDS, Listing
+from listing_index import plain_value
+from listing_log import StaleSegmentError, listing_id, open_tombstones
+from listing_store import CsvLoader
+from post_writer import get_writer
+from text_index import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # Signatures are then computed in Python, with the same values
+    np = None
+
+OFF = "off"
+FLAG = "flag"
+MERGE = "merge"
+MODES = (OFF, FLAG, MERGE)
+
+SHINGLE_CHARS = 4
+PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = PERMUTATIONS // BANDS
+
+# Minimum estimated Jaccard similarity of two descriptions
+THRESHOLD = 0.6
+
+# Largest cost difference, relative to the higher cost, between two versions of a listing
+MAX_COST_CHANGE = 0.25
+
+# Hash functions (a * x + b) mod a prime below 2**32, so the products fit in
+# 64 bits; fixed seed, so every process computes the same signatures
+_PRIME = 4294967291
+_random = random.Random(25)
+_A = [_random.randrange(1, _PRIME) for _ in range(PERMUTATIONS)]
+_B = [_random.randrange(0, _PRIME) for _ in range(PERMUTATIONS)]
+if np is not None:
+    _A_ARRAY = np.array(_A, dtype=np.uint64)[:, None]
+    _B_ARRAY = np.array(_B, dtype=np.uint64)[:, None]
+
+DUPLICATES_FOUND = metrics.counter("duplicate_posts_total", "Posts found to duplicate a listing, by mode")
+LSH_CANDIDATES = metrics.counter("duplicate_candidates_total", "Listings compared with a post after the LSH lookup")
+
+# Loader for stores opened only to check posts, e.g. from the command-line scripts
+read_listings = CsvLoader(Listing.from_row)
+
+Signature = Tuple[int, ...]
+
+# (location, rooms, floor), which must be equal for two listings to be duplicates
+ExactKey = Tuple
+
+
+class Match(NamedTuple):
+    row_id: int
+    similarity: float
+
+
+def shingles(text: Optional[str]) -> FrozenSet[int]:
+    """Hashes of the overlapping SHINGLE_CHARS-character pieces of the normalized text."""
+    normalized = " ".join(tokenize(text))
+    if not normalized:
+        return frozenset()
+    if len(normalized) <= SHINGLE_CHARS:
+        return frozenset((zlib.crc32(normalized.encode("utf-8")),))
+    return frozenset(
+        zlib.crc32(normalized[i:i + SHINGLE_CHARS].encode("utf-8"))
+        for i in range(len(normalized) - SHINGLE_CHARS + 1)
+    )
+
+
+def minhash(hashes: FrozenSet[int]) -> Signature:
+    """Smallest value of each hash function over the shingles."""
+    if np is not None:
+        values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+        return tuple(((_A_ARRAY * values + _B_ARRAY) % _PRIME).min(axis=1).tolist())
+    return tuple(min((a * x + b) % _PRIME for x in hashes) for a, b in zip(_A, _B))
+
+
+def similarity(first: Signature, second: Signature) -> float:
+    """Estimated Jaccard similarity: the share of equal signature entries."""
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+def exact_key(listing) -> ExactKey:
+    place = getattr(listing, "place", None)
+    return (plain_value(place) if place is not None else listing.location, listing.rooms,
+            plain_value(listing.floor))
+
+
+def listing_from_post(row: dict) -> Listing:
+    """The Listing a row written by post_writer.py reads back as."""
+    return Listing.from_row({key: "" if value is None else str(value) for key, value in row.items()})
+
+
+class DuplicateIndex:
+    """MinHash signatures of the listings, bucketed by band.
+
+    Works as a ListingStore derived structure: add() and remove() keep it in
+    step with appended and deleted rows. Rows are only grouped by exact key
+    until find() is first asked about their group.
+    """
+
+    def __init__(self, listings: Sequence, threshold: float = THRESHOLD,
+                 max_cost_change: float = MAX_COST_CHANGE):
+        self.threshold = threshold
+        self.max_cost_change = max_cost_change
+        self.entries: Dict[int, Tuple[ExactKey, Signature, Optional[int]]] = {}
+        self.buckets: Dict[tuple, List[int]] = {}
+        # Rows with a description but no signature yet, by exact key
+        self.pending: Dict[ExactKey, Dict[int, Listing]] = {}
+        self._lock = threading.Lock()
+        for row_id, listing in enumerate(listings):
+            self.add(row_id, listing)
+
+    @staticmethod
+    def _bands(key: ExactKey, signature: Signature) -> List[tuple]:
+        return [(key, band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]) for band in range(BANDS)]
+
+    def add(self, row_id: int, listing):
+        if not getattr(listing, "descr", None):
+            return
+        key = exact_key(listing)
+        with self._lock:
+            self.pending.setdefault(key, {})[row_id] = listing
+
+    def _sign(self, key: ExactKey):
+        """Fingerprint the rows of one group that aren't yet; called with _lock held."""
+        for row_id, listing in self.pending.pop(key, {}).items():
+            hashes = shingles(listing.descr)
+            if not hashes:
+                continue
+            signature = minhash(hashes)
+            self.entries[row_id] = (key, signature, listing.cst)
+            for bucket in self._bands(key, signature):
+                self.buckets.setdefault(bucket, []).append(row_id)
+
+    def remove(self, row_id: int, listing):
+        with self._lock:
+            if self.pending.get(exact_key(listing), {}).pop(row_id, None) is not None:
+                return
+            entry = self.entries.pop(row_id, None)
+            if entry is None:
+                return
+            for bucket in self._bands(entry[0], entry[1]):
+                rows = self.buckets[bucket]
+                rows.remove(row_id)
+                if not rows:
+                    del self.buckets[bucket]
+
+    def _close_cost(self, first: Optional[int], second: Optional[int]) -> bool:
+        if first is None or second is None:
+            return True
+        return abs(first - second) <= self.max_cost_change * max(abs(first), abs(second))
+
+    def find(self, listing) -> List[Match]:
+        """Indexed listings that this one duplicates, most similar first."""
+        hashes = shingles(getattr(listing, "descr", None))
+        if not hashes:
+            return []
+        key = exact_key(listing)
+        signature = minhash(hashes)
+        with self._lock:
+            self._sign(key)
+            candidates: Set[int] = set()
+            for bucket in self._bands(key, signature):
+                candidates.update(self.buckets.get(bucket, ()))
+            LSH_CANDIDATES.inc(len(candidates))
+            matches = []
+            for row_id in candidates:
+                _, other, cost = self.entries[row_id]
+                if not self._close_cost(listing.cst, cost):
+                    continue
+                score = similarity(signature, other)
+                if score >= self.threshold:
+                    matches.append(Match(row_id, score))
+        matches.sort(key=lambda match: (-match.similarity, match.row_id))
+        return matches
+
+
+def find_duplicates(index: DuplicateIndex, listings: Sequence) -> List[Tuple[List[int], List[int]]]:
+    """For each new listing, the indexed rows it duplicates and the earlier positions in listings it does."""
+    batch = DuplicateIndex([], index.threshold, index.max_cost_change)
+    found = []
+    for position, listing in enumerate(listings):
+        existing = [match.row_id for match in index.find(listing)]
+        earlier = sorted(match.row_id for match in batch.find(listing))
+        batch.add(position, listing)
+        found.append((existing, earlier))
+    return found
+
+
+def append_posts(store, rows: List[dict], mode: str = FLAG,
+                 fieldnames: Sequence[str] = LISTING_FIELDS) -> Tuple[int, List[Tuple[int, dict]]]:
+    """Append posted rows to the store's CSV, checking them for re-posts.
+
+    Returns the number of rows written and (position in rows, report) for each
+    row that duplicates a listing, where the report is {"duplicate_of": [listing ids], "duplicate_of_index":
+    [positions]} with FLAG. With MERGE the keys are "replaced" and
+    "replaced_index". The positions are those of earlier rows of the same
+    call, which MERGE leaves out.
+    """
+    if mode not in MODES:
+        raise ValueError(f"duplicate mode must be one of {', '.join(MODES)}, not {mode!r}")
+    writer = get_writer(store.filename, fieldnames)
+    if mode == OFF:
+        writer.submit_many(rows)
+        return len(rows), []
+
+    listings = [listing_from_post(row) for row in rows]
+    while True:
+        store.get()
+        segment = store.segment
+        with metrics.STAGE_SECONDS.time(stage="duplicate_check"):
+            found = find_duplicates(store.derived("duplicates", DuplicateIndex), listings)
+        prefix = "duplicate_of" if mode == FLAG else "replaced"
+        reports = []
+        for position, (existing, earlier) in enumerate(found):
+            report = {}
+            if existing:
+                report[prefix] = [listing_id(segment, row_id) for row_id in existing]
+            if earlier:
+                report[prefix + "_index"] = earlier
+            if report:
+                reports.append((position, report))
+        DUPLICATES_FOUND.inc(len(reports), mode=mode)
+
+        replaced = sorted({row_id for existing, _ in found for row_id in existing})
+        kept = rows
+        if mode == FLAG or not reports:
+            writer.submit_many(kept)
+            break
+        # A later version in the same batch wins over an earlier one
+        superseded = {position for _, earlier in found for position in earlier}
+        kept = [row for position, row in enumerate(rows) if position not in superseded]
+        if not replaced:
+            writer.submit_many(kept)
+            break
+        try:
+            # Held across the append so compaction can't move the rows being replaced
+            with open_tombstones(store.filename, segment) as tombstones:
+                deleted = set(tombstones.rows())
+                writer.submit_many(kept)
+                tombstones.delete(row_id for row_id in replaced if row_id not in deleted)
+            break
+        except StaleSegmentError:
+            continue  # Compacted in the meantime: match against the new file
+    store.get()
+    return len(kept), reports
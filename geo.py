@@ -0,0 +1,173 @@
+"""Coordinates of the Location values and the distances between them.
+
+Every listing is reduced to a place id: its Location, or the campus centre
+for listings only marked as on campus. Distances between places are computed
+once, at import, so a query costs one table lookup per listing. Free-form
+points ("49.26,-123.25") are placed on a grid so a radius search only
+measures the places in nearby cells.
+
+Filters: {"near": "Kitsilano" or "lat,lon", "within_km": 3}. near alone
+only ranks closer listings first; within_km also filters, and counts as a
+matched predicate when ranking.
+"""
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from listing import Location
+
+Point = Tuple[float, float]  # (latitude, longitude) in degrees
+
+# Approximate coordinates of each residence or neighbourhood
+COORDINATES: Dict[Location, Point] = {
+    Location.BROCK_COMMONS: (49.2694, -123.2545),
+    Location.EXCHANGE: (49.2676, -123.2478),
+    Location.FAIRVIEW_CRESCENT: (49.2643, -123.2447),
+    Location.FRASER_HALL: (49.2631, -123.2420),
+    Location.GREEN_COLLEGE: (49.2720, -123.2560),
+    Location.IONA_HOUSE: (49.2689, -123.2521),
+    Location.MARINE_DRIVE: (49.2612, -123.2566),
+    Location.PONDEROSA_COMMONS: (49.2642, -123.2546),
+    Location.ST_JOHNS_COLLEGE: (49.2596, -123.2431),
+    Location.TESHXWHELELMS_TEKWAƛKEʔAʔL: (49.2645, -123.2560),
+    Location.WESBROOK_VILLAGE: (49.2525, -123.2360),
+    Location.KITSILANO: (49.2684, -123.1683),
+    Location.RICHMOND: (49.1666, -123.1336),
+    Location.WEST_POINT_GREY: (49.2660, -123.2000),
+}
+
+# Where listings posted with location=True (on campus, no residence) are placed
+CAMPUS: Point = (49.2606, -123.2460)
+
+# Place ids: the Location members in definition order, then the campus centre
+LOCATIONS: List[Location] = list(Location)
+LOCATION_IDS: Dict[Location, int] = {location: place for place, location in enumerate(LOCATIONS)}
+CAMPUS_ID = len(LOCATIONS)
+POINTS: List[Point] = [COORDINATES[location] for location in LOCATIONS] + [CAMPUS]
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Side of a grid cell for free-form points
+CELL_KM = 2.0
+
+
+def haversine_km(a: Point, b: Point) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+# DISTANCE_KM[i][j] is the distance between places i and j
+DISTANCE_KM: List[List[float]] = [[haversine_km(a, b) for b in POINTS] for a in POINTS]
+
+
+def place_id(listing) -> Optional[int]:
+    """Place of a listing, or None if it can't be placed (e.g. location=False)."""
+    place = getattr(listing, "place", None)
+    if place is not None:
+        return LOCATION_IDS[place]
+    return CAMPUS_ID if getattr(listing, "location", None) is True else None
+
+
+class GridIndex:
+    """Points bucketed into square cells of roughly cell_km per side."""
+
+    def __init__(self, points: Sequence[Point], cell_km: float = CELL_KM):
+        self.points = list(points)
+        self.cell_km = cell_km
+        # Degrees of latitude are ~111 km everywhere; longitude shrinks with cos(latitude)
+        self.lat_step = cell_km / 111.32
+        reference = math.radians(sum(lat for lat, _ in points) / len(points)) if points else 0.0
+        self.lon_step = cell_km / (111.32 * math.cos(reference))
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        for point_id, point in enumerate(self.points):
+            self.cells.setdefault(self._cell(point), []).append(point_id)
+
+    def _cell(self, point: Point) -> Tuple[int, int]:
+        return math.floor(point[0] / self.lat_step), math.floor(point[1] / self.lon_step)
+
+    def within(self, point: Point, km: float) -> Dict[int, float]:
+        """Ids of the points within km of point, with their distances."""
+        row, column = self._cell(point)
+        # One extra cell of margin covers the longitude step being exact only at the reference latitude
+        reach = math.ceil(km / self.cell_km) + 1
+        found = {}
+        for i in range(row - reach, row + reach + 1):
+            for j in range(column - reach, column + reach + 1):
+                for point_id in self.cells.get((i, j), ()):
+                    distance = haversine_km(point, self.points[point_id])
+                    if distance <= km:
+                        found[point_id] = distance
+        return found
+
+
+GRID = GridIndex(POINTS)
+
+# Filter keys handled here rather than by predicate_matches
+GEO_KEYS = ("near", "within_km")
+
+
+def resolve_place(value: str) -> Optional[int]:
+    """Place id of a Location name or value, if it is one."""
+    text = value.strip()
+    for place, location in enumerate(LOCATIONS):
+        if text.casefold() in (location.value.casefold(), location.name.casefold()):
+            return place
+    return None
+
+
+def resolve_point(value: str) -> Point:
+    """A Location name, or "lat,lon"; raises ValueError for anything else."""
+    place = resolve_place(value)
+    if place is not None:
+        return POINTS[place]
+    try:
+        lat, lon = (float(part) for part in value.split(","))
+    except ValueError:
+        raise ValueError(f"near must be a Location or 'lat,lon', not {value!r}") from None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"near is out of range: {value!r}")
+    return lat, lon
+
+
+class GeoQuery:
+    """Distance from one point to every place, and the places within a radius."""
+
+    def __init__(self, near: str, within_km: Optional[float] = None):
+        self.near = near
+        self.within_km = within_km
+        place = resolve_place(near)
+        if place is not None:
+            self.distances = DISTANCE_KM[place]
+        else:
+            point = resolve_point(near)
+            self.distances = [haversine_km(point, other) for other in POINTS]
+        if within_km is None:
+            self.inside = None
+        elif place is not None:
+            self.inside = frozenset(i for i, distance in enumerate(self.distances) if distance <= within_km)
+        else:
+            self.inside = frozenset(GRID.within(resolve_point(near), within_km))
+
+    def distance(self, listing) -> Optional[float]:
+        place = place_id(listing)
+        return None if place is None else self.distances[place]
+
+    def matches(self, listing) -> bool:
+        """Whether the listing is within the radius; True when there is no radius."""
+        return self.inside is None or place_id(listing) in self.inside
+
+
+def split_filters(filters: Optional[dict]) -> Tuple[dict, Optional[GeoQuery]]:
+    """Separate the geo filters from those predicate_matches understands.
+
+    within_km without near is ignored here; test1.parse_filters rejects it
+    when a client posts it.
+    """
+    if not filters:
+        return {}, None
+    plain = {key: value for key, value in filters.items() if key not in GEO_KEYS}
+    near = filters.get("near")
+    if near is None:
+        return plain, None
+    within = filters.get("within_km")
+    return plain, GeoQuery(near, float(within) if within is not None else None)
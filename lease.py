@@ -0,0 +1,155 @@
+"""Parses the free-text lease length column.
+
+Handles durations ("6 months lease", "1 year", "12 weeks", a bare "3"
+meaning months) and availability windows ("From Dec 12 to January 31",
+"Sept 1 - Apr 30 2027", "until May 31", "starting 2026-09-01"). A window
+without a year is placed in the first year in which it has not ended yet;
+when only one of its dates gives a year, the other is placed next to it.
+
+Each distinct text is parsed once per reference date, and equal results are
+one shared Lease, so a listing only holds a reference to its lease.
+"""
+import re
+import sys
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple
+
+MONTHS = {
+    name: number
+    for number, names in enumerate([
+        ("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may",),
+        ("jun", "june"), ("jul", "july"), ("aug", "august"), ("sep", "sept", "september"),
+        ("oct", "october"), ("nov", "november"), ("dec", "december"),
+    ], start=1)
+    for name in names
+}
+
+DAYS_PER_MONTH = 30.44
+
+_MONTH = "|".join(sorted(MONTHS, key=len, reverse=True))
+
+
+def _date_pattern(prefix: str) -> str:
+    """An ISO date, or a month name and day with an optional year; groups are prefixed."""
+    return (rf"(?:(?P<{prefix}iso>\d{{4}}-\d{{2}}-\d{{2}})"
+            rf"|\b(?P<{prefix}month>{_MONTH})\.?\s+(?P<{prefix}day>\d{{1,2}})(?:st|nd|rd|th)?\b,?"
+            rf"(?:\s+(?P<{prefix}year>\d{{4}}))?)")
+
+
+_START = _date_pattern("s")
+_END = _date_pattern("e")
+
+RANGE_RE = re.compile(rf"(?:from\s+)?{_START}\s*(?:to|until|till|through|-|–)\s*{_END}")
+START_RE = re.compile(rf"\b(?:from|starting|start|available|beginning)\s+(?:on\s+)?{_START}")
+END_RE = re.compile(rf"\b(?:until|till|to|through|ending)\s+{_END}")
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(months?|mos?|years?|yrs?|weeks?|wks?)\b")
+BARE_MONTHS_RE = re.compile(r"^\s*(\d+)\s*$")
+
+
+class Lease(NamedTuple):
+    months: Optional[int]  # Duration in whole months
+    start: Optional[str]  # ISO date the sublet is available from
+    end: Optional[str]  # ISO date it ends
+
+
+NO_LEASE = Lease(None, None, None)
+
+# Every distinct Lease parsed so far; bounded by the distinct windows and
+# durations posted, not by the number of listings
+_leases: Dict[Lease, Lease] = {NO_LEASE: NO_LEASE}
+
+
+def _date(match, prefix: str, year: int) -> Tuple[Optional[date], bool]:
+    """The date a RANGE/START/END match names, in year unless it gives one, and whether it did."""
+    iso = match.group(prefix + "iso")
+    if iso:
+        try:
+            return date.fromisoformat(iso), True
+        except ValueError:
+            return None, False
+    try:
+        given = match.group(prefix + "year")
+        return date(int(given) if given else year, MONTHS[match.group(prefix + "month")],
+                    int(match.group(prefix + "day"))), given is not None
+    except ValueError:  # e.g. February 30
+        return None, False
+
+
+def _add_year(day: date, years: int = 1) -> date:
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:  # February 29
+        return day.replace(year=day.year + years, day=28)
+
+
+def _months_between(start: date, end: date) -> int:
+    return round((end - start).days / DAYS_PER_MONTH)
+
+
+def parse_lease(text: Optional[str], reference: Optional[date] = None) -> Lease:
+    """Parse a length cell; reference (default today) places windows given without a year."""
+    if not text:
+        return NO_LEASE
+    # Resolved before the cache, so a long-running process doesn't keep the first day's windows
+    return _parse_lease(text, reference or date.today())
+
+
+@lru_cache(maxsize=1024)
+def _parse_lease(text: str, reference: date) -> Lease:
+    lowered = text.lower()
+
+    months = None
+    duration = DURATION_RE.search(lowered)
+    if duration:
+        amount = float(duration.group(1))
+        unit = duration.group(2)
+        if unit.startswith("y"):
+            months = round(amount * 12)
+        elif unit.startswith("w"):
+            months = round(amount * 7 / DAYS_PER_MONTH)
+        else:
+            months = round(amount)
+    elif BARE_MONTHS_RE.match(lowered):
+        months = int(lowered)
+
+    start = end = None
+    window = RANGE_RE.search(lowered)
+    if window:
+        start, start_year = _date(window, "s", reference.year)
+        end, end_year = _date(window, "e", start.year if start_year else reference.year)
+        if end and end_year and not start_year:
+            # "Jan 5 - Apr 30 2027": the start is in the end's year, or the one before
+            start = _date(window, "s", end.year)[0]
+            if start and start > end:
+                start = _date(window, "s", end.year - 1)[0]
+        if start and end:
+            if end < start:
+                end = _add_year(end)
+            if not start_year and not end_year and end < reference:
+                start, end = _add_year(start), _add_year(end)
+        elif end and not end_year and end < reference:
+            end = _add_year(end)
+    else:
+        match = START_RE.search(lowered)
+        if match:
+            start, has_year = _date(match, "s", reference.year)
+            if start and not has_year and start < reference - timedelta(days=183):
+                start = _add_year(start)
+        match = END_RE.search(lowered)
+        if match:
+            end, has_year = _date(match, "e", reference.year)
+            if end and not has_year and end < reference:
+                end = _add_year(end)
+
+    if start and end is None and months:
+        end = start + timedelta(days=round(months * DAYS_PER_MONTH))
+    if start and end and end >= start and months is None:
+        months = _months_between(start, end)
+    # Dates are interned too: far fewer distinct days than windows
+    lease = Lease(
+        months,
+        sys.intern(start.isoformat()) if start else None,
+        sys.intern(end.isoformat()) if end else None,
+    )
+    return _leases.setdefault(lease, lease)
@@ -0,0 +1,179 @@
+import sys
+from enum import Enum
+from typing import Dict, Optional
+
+from lease import Lease, parse_lease
+from listing_index import predicate_matches
+
+# Column order of user_data.csv
+LISTING_FIELDS = ("cst", "location", "descr", "rooms", "ppl", "length", "laundry", "parking", "gender", "floor", "pets")
+
+
+# Enum for locations
+class Location(Enum):
+    BROCK_COMMONS = "Brock Commons"
+    EXCHANGE = "Exchange"
+    FAIRVIEW_CRESCENT = "Fairview Crescent"
+    FRASER_HALL = "Fraser Hall"
+    GREEN_COLLEGE = "Green College"
+    IONA_HOUSE = "Iona House"
+    MARINE_DRIVE = "Marine Drive"
+    PONDEROSA_COMMONS = "Ponderosa Commons"
+    ST_JOHNS_COLLEGE = "St. John’s College"
+    TESHXWHELELMS_TEKWAƛKEʔAʔL = "tə šxʷhəleləm̓s tə k̓ʷaƛ̓kʷəʔaʔɬ"
+    WESBROOK_VILLAGE = "Wesbrook Village"
+    KITSILANO = "Kitsilano"
+    RICHMOND = "Richmond"
+    WEST_POINT_GREY = "West Point Grey"
+
+
+# Enum for floor preference
+class FloorPreference(Enum):
+    BOTTOM = "bottom"
+    MIDDLE = "middle"
+    TOP = "top"
+
+
+def parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def parse_bool(value: Optional[str]) -> Optional[bool]:
+    # Rows written by test1.py hold True/False, the CLI scripts yes/no
+    return value.strip().lower() in ("true", "yes") if value else None
+
+
+def parse_floor(value: Optional[str]) -> Optional[FloorPreference]:
+    if value and value.upper() in FloorPreference.__members__:
+        return FloorPreference[value.upper()]
+    return None
+
+
+def parse_place(value: Optional[str]) -> Optional[Location]:
+    """The Location named by a location cell; True/False or free text give None."""
+    if value:
+        try:
+            return Location(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+# Codes of the location column's values for the location slot of Listing
+_ON_CAMPUS = {None: 0, False: 1, True: 2}
+_PLACES = list(Location)
+_PLACE_CODES = {location: 3 * (index + 1) for index, location in enumerate(_PLACES)}
+
+
+def intern_str(value: Optional[str]) -> Optional[str]:
+    """Share one copy of repeated strings such as gender or lease length."""
+    return sys.intern(value) if value is not None else None
+
+
+# Costs seen so far; rents repeat, but only ints up to 256 are cached by Python
+_costs: Dict[int, int] = {}
+
+
+def intern_cost(value: Optional[int]) -> Optional[int]:
+    """Share one int object per distinct cost."""
+    return _costs.setdefault(value, value) if value is not None else None
+
+
+class Listing:
+    """One sublet listing, shared by the CSV readers, the ranker and the API.
+
+    Uses __slots__ instead of a per-instance __dict__. Booleans, small ints
+    and FloorPreference members are singletons, and costs and the categorical
+    strings are interned, so a listing holds little more than its description.
+
+    place is not a column of its own: it is the Location named in the
+    location column, which location itself only reads as on/off campus.
+    Both are kept in one slot as a small int (cached by Python, like the
+    booleans): location in code % 3 and place in code // 3. lease is the
+    length text parsed once, and listings with the same lease share one
+    Lease; lease_months, lease_start and lease_end read from it.
+    """
+
+    __slots__ = tuple(field for field in LISTING_FIELDS if field != "location") + ("_location", "lease")
+
+    def __init__(self, cst, location, descr, rooms, ppl, length, laundry, parking, gender, floor, pets,
+                 place=None):
+        self.cst = intern_cost(cst)
+        self._location = _ON_CAMPUS[location] + (0 if place is None else _PLACE_CODES[place])
+        self.descr = descr
+        self.rooms = rooms
+        self.ppl = ppl
+        self.length = length
+        self.laundry = laundry
+        self.parking = parking
+        self.gender = gender
+        self.floor = floor
+        self.pets = pets
+        self.lease: Lease = parse_lease(length)
+
+    @property
+    def location(self) -> Optional[bool]:
+        return (None, False, True)[self._location % 3]
+
+    @property
+    def place(self) -> Optional[Location]:
+        code = self._location // 3
+        return _PLACES[code - 1] if code else None
+
+    @property
+    def lease_months(self) -> Optional[int]:
+        return self.lease.months
+
+    @property
+    def lease_start(self) -> Optional[str]:
+        return self.lease.start
+
+    @property
+    def lease_end(self) -> Optional[str]:
+        return self.lease.end
+
+    @classmethod
+    def from_row(cls, row: dict) -> "Listing":
+        """Parse one csv.DictReader row of user_data.csv."""
+        return cls(
+            cst=parse_int(row.get('cst')),
+            location=parse_bool(row.get('location')),
+            descr=row.get('descr'),
+            rooms=parse_int(row.get('rooms')),
+            ppl=parse_int(row.get('ppl')),
+            length=intern_str(row.get('length')),
+            laundry=parse_bool(row.get('laundry')),
+            parking=parse_bool(row.get('parking')),
+            gender=intern_str(row.get('gender')),
+            floor=parse_floor(row.get('floor')),
+            pets=parse_bool(row.get('pets')),
+            place=parse_place(row.get('location'))
+        )
+
+    def to_dict(self):
+        return {
+            "cst": self.cst,
+            "location": self.location,
+            "descr": self.descr,
+            "rooms": self.rooms,
+            "ppl": self.ppl,
+            "length": self.length,
+            "laundry": self.laundry,
+            "parking": self.parking,
+            "gender": self.gender,
+            "floor": self.floor.value if self.floor else None,
+            "pets": self.pets
+        }
+
+    def matches_filter(self, filters):
+        for key, value in filters.items():
+            if value is not None and not predicate_matches(self, key, value):
+                return False
+        return True
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in LISTING_FIELDS)
+        return f"Listing({fields})"
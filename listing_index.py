@@ -0,0 +1,263 @@
+from bisect import bisect_left, bisect_right
+from enum import Enum
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import metrics
+
+# Low-cardinality fields that get a bitmap index
+BITMAP_FIELDS = ("location", "gender", "floor", "laundry", "parking", "pets")
+
+# Numeric fields that get a sorted index and accept min_/max_ filters,
+# e.g. {"max_cst": 1500, "min_rooms": 2, "min_ppl": 1, "max_ppl": 3}. The
+# lease fields are parsed from the length text (lease.py); the dates are ISO
+# strings, so "available between A and B" is max_lease_start=B, min_lease_end=A
+RANGE_FIELDS = ("cst", "rooms", "ppl", "lease_months", "lease_start", "lease_end")
+
+# Rows added since the index was built are kept in small side buffers and
+# merged into the main structures once this many have piled up, so adding a
+# row does not copy data proportional to the size of the index
+FOLD_THRESHOLD = 1024
+
+# Set bit positions of every byte value, used to turn a bitset back into row ids
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+def plain_value(value) -> Any:
+    """Enums are compared by their value, as in to_dict()."""
+    return value.value if isinstance(value, Enum) else value
+
+
+def field_value(listing, field: str) -> Any:
+    """Value of a field as it appears in to_dict()."""
+    return plain_value(getattr(listing, field, None))
+
+
+def parse_range_key(key: str) -> Optional[Tuple[str, str]]:
+    """Split a range filter key such as "max_cst" into ("cst", "max")."""
+    bound, _, field = key.partition("_")
+    if bound in ("min", "max") and field in RANGE_FIELDS:
+        return field, bound
+    return None
+
+
+def predicate_matches(listing, key: str, value) -> bool:
+    """Check one filter entry against a listing, without any index."""
+    range_key = parse_range_key(key)
+    if range_key is None:
+        return field_value(listing, key) == plain_value(value)
+    field, bound = range_key
+    actual = getattr(listing, field, None)
+    if actual is None:
+        return False
+    return actual >= value if bound == "min" else actual <= value
+
+
+def bits_from_rows(row_ids: Iterable[int], size: int) -> int:
+    """Build a bitset (a Python int with bit i set for row i) in one pass."""
+    buffer = bytearray((size + 7) // 8)
+    for row_id in row_ids:
+        buffer[row_id >> 3] |= 1 << (row_id & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def rows_from_bits(bits: int) -> List[int]:
+    """Return the positions of the set bits in ascending order."""
+    rows = []
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for byte_index, byte in enumerate(data):
+        if byte:
+            base = byte_index * 8
+            rows.extend(base + bit for bit in _BYTE_BITS[byte])
+    return rows
+
+
+def iter_bits(bits: int) -> Iterator[int]:
+    """Lazily yield the positions of the set bits in ascending order."""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for byte_index, byte in enumerate(data):
+        if byte:
+            base = byte_index * 8
+            for bit in _BYTE_BITS[byte]:
+                yield base + bit
+
+
+class BitmapIndex:
+    """Maps each value of one field to the bitset of rows holding that value."""
+
+    def __init__(self, field: str, listings: List):
+        self.field = field
+        rows_by_value: Dict[Any, List[int]] = {}
+        for row_id, listing in enumerate(listings):
+            rows_by_value.setdefault(field_value(listing, field), []).append(row_id)
+        size = len(listings)
+        # (bitmaps, added rows not folded into them yet), replaced as one by
+        # fold() so a lookup never sees a row in both or in neither
+        self.state: Tuple[Dict[Any, int], Dict[Any, List[int]]] = (
+            {value: bits_from_rows(rows, size) for value, rows in rows_by_value.items()}, {})
+        self.recent_count = 0
+
+    def add(self, row_id: int, value):
+        self.state[1].setdefault(value, []).append(row_id)
+        self.recent_count += 1
+        if self.recent_count >= FOLD_THRESHOLD:
+            self.fold()
+
+    def fold(self):
+        bitmaps, recent = self.state
+        bitmaps = dict(bitmaps)
+        for value, rows in recent.items():
+            bitmaps[value] = bitmaps.get(value, 0) | bits_from_rows(rows, rows[-1] + 1)
+        self.state = (bitmaps, {})
+        self.recent_count = 0
+
+    def lookup(self, value) -> int:
+        bitmaps, recent = self.state
+        bits = bitmaps.get(value, 0)
+        rows = recent.get(value, [])[:]  # add() may append to it meanwhile
+        if rows:
+            bits |= bits_from_rows(rows, rows[-1] + 1)
+        return bits
+
+
+class RangeIndex:
+    """Row ids sorted by one numeric field, so a range is a binary search plus a slice."""
+
+    def __init__(self, field: str, listings: List):
+        self.field = field
+        pairs = sorted(
+            (value, row_id) for row_id, listing in enumerate(listings)
+            if (value := getattr(listing, field, None)) is not None
+        )
+        # (values, rows, recent values, recent rows), where the recent ones are
+        # added rows sorted the same way but not merged in yet. Writers build new
+        # lists and replace the whole tuple, so a lookup that doesn't hold the
+        # store lock always sees values and rows that belong together.
+        self.lists: Tuple[List, List[int], List, List[int]] = (
+            [value for value, _ in pairs], [row_id for _, row_id in pairs], [], [])
+
+    @staticmethod
+    def _slice(values: List, rows: List[int], low, high) -> List[int]:
+        start = bisect_left(values, low) if low is not None else 0
+        end = bisect_right(values, high) if high is not None else len(values)
+        return rows[start:end]
+
+    def rows_between(self, low=None, high=None) -> List[int]:
+        """Return the rows with low <= value <= high; a None bound is open."""
+        values, rows, recent_values, recent_rows = self.lists
+        found = self._slice(values, rows, low, high)
+        if recent_values:
+            found = found + self._slice(recent_values, recent_rows, low, high)
+        return found
+
+    def add(self, row_id: int, value):
+        """Insert a newly appended row, keeping the index sorted."""
+        if value is None:
+            return
+        values, rows, recent_values, recent_rows = self.lists
+        position = bisect_right(recent_values, value)
+        self.lists = (values, rows,
+                      recent_values[:position] + [value] + recent_values[position:],
+                      recent_rows[:position] + [row_id] + recent_rows[position:])
+        if len(recent_values) + 1 >= FOLD_THRESHOLD:
+            self.fold()
+
+    def fold(self):
+        values, rows, recent_values, recent_rows = self.lists
+        pairs = sorted(zip(values + recent_values, rows + recent_rows))
+        self.lists = ([value for value, _ in pairs], [row_id for _, row_id in pairs], [], [])
+
+
+class ListingIndex:
+    """Answers equality filters with an AND of bitmaps and range filters with sorted indexes.
+
+    Fields without an index are checked by scanning only the rows the indexes
+    left over. Results are the same, and in the same order, as keeping the
+    listings for which Listing.matches_filter holds. Removed rows are masked
+    out of every lookup.
+    """
+
+    def __init__(self, listings: List, fields: Tuple[str, ...] = BITMAP_FIELDS,
+                 range_fields: Tuple[str, ...] = RANGE_FIELDS):
+        self.listings = listings
+        self.bitmaps = {field: BitmapIndex(field, listings) for field in fields}
+        self.ranges = {field: RangeIndex(field, listings) for field in range_fields}
+        self.removed = 0  # Bitset of deleted rows
+
+    def add(self, row_id: int, listing):
+        """Index a listing the store has just appended to the shared list."""
+        for field, index in self.bitmaps.items():
+            index.add(row_id, field_value(listing, field))
+        for field, index in self.ranges.items():
+            index.add(row_id, getattr(listing, field, None))
+
+    def remove(self, row_id: int, listing):
+        """Leave out a row the store has deleted; its entries stay until the index is rebuilt."""
+        self.removed |= 1 << row_id
+
+    def live_bits(self) -> int:
+        """Bitset of every row that hasn't been removed."""
+        # The listings list is shared with the store, so it includes added rows
+        return ((1 << len(self.listings)) - 1) & ~self.removed
+
+    def _candidates(self, filters: dict) -> Tuple[int, List[Tuple[str, Any]]]:
+        """AND the indexed predicates into a bitset; return it with the predicates left to check."""
+        bits = self.live_bits()
+        unindexed = []
+        bounds: Dict[str, Dict[str, Any]] = {}
+        for key, value in filters.items():
+            if value is None:
+                continue
+            range_key = parse_range_key(key)
+            if range_key is not None:
+                field, bound = range_key
+                if field in self.ranges:
+                    bounds.setdefault(field, {})[bound] = value
+                else:
+                    unindexed.append((key, value))
+                continue
+            index = self.bitmaps.get(key)
+            if index is None:
+                unindexed.append((key, value))
+                continue
+            bits &= index.lookup(plain_value(value))
+            if not bits:
+                return 0, []
+
+        size = len(self.listings)
+        for field, bound in bounds.items():
+            bits &= bits_from_rows(self.ranges[field].rows_between(bound.get("min"), bound.get("max")), size)
+            if not bits:
+                return 0, []
+        return bits, unindexed
+
+    def match_rows(self, filters: dict) -> List[int]:
+        """Return the ids of the rows matching every non-None filter value."""
+        bits, unindexed = self._candidates(filters)
+        rows = rows_from_bits(bits)
+        if unindexed:
+            metrics.ROWS_SCANNED.inc(len(rows))
+            listings = self.listings
+            rows = [
+                row_id for row_id in rows
+                if all(predicate_matches(listings[row_id], key, value) for key, value in unindexed)
+            ]
+        return rows
+
+    def iter_rows(self, filters: Optional[dict], start: int = 0) -> Iterator[int]:
+        """Lazily yield the matching row ids from start on, in row order.
+
+        Memory use does not depend on how many rows match.
+        """
+        bits, unindexed = self._candidates(filters or {})
+        listings = self.listings
+        for row_id in iter_bits(bits >> start):
+            row_id += start
+            if all(predicate_matches(listings[row_id], key, value) for key, value in unindexed):
+                yield row_id
+
+    def filter(self, filters: Optional[dict]) -> List:
+        """Return the listings matching the filters."""
+        listings = self.listings
+        if not filters:
+            return [listings[row_id] for row_id in rows_from_bits(self.live_bits())]
+        return [listings[row_id] for row_id in self.match_rows(filters)]
@@ -0,0 +1,385 @@
+"""Deletes, updates and compaction of user_data.csv.
+
+The CSV stays an append-only log: post_writer.py appends new listings to it
+and rows never move while it is in use. Deleting a listing appends its row
+position to a tombstone file next to the CSV (user_data.csv.tombstones);
+updating one appends the new version and tombstones the old. Readers skip
+tombstoned rows.
+
+compact() rewrites the CSV with only its live, well-formed rows, in their
+original order, and replaces the file. Malformed rows, such as two records
+run together on one line, are moved to user_data.csv.rejected. Row
+positions change, so every version of the file is a new segment, and
+listing ids include the segment they were handed out for:
+
+    python listing_log.py nwhack25/user_data.csv
+
+The tombstone file starts with the segment number and the inode of the CSV
+it belongs to. Segment numbers only ever go up: compaction writes the next
+one, and so does the first writer to find a header left by another file,
+e.g. after a crash between the two replaces or a CSV replaced by hand.
+Inodes alone can't tell segments apart, as the filesystem reuses them. Lock
+order is tombstones, then CSV.
+"""
+import csv
+import io
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; see post_writer.py
+    fcntl = None
+
+TOMBSTONES = metrics.counter("listing_tombstones_total", "Listing rows deleted or replaced")
+COMPACTIONS = metrics.counter("listing_compactions_total", "Rewrites of the listings CSV without dead rows")
+
+# Compact once this share of the rows is tombstoned
+COMPACT_FRACTION = 0.2
+
+
+# Called as hook(segment, new segment, kept rows) while compact() holds its
+# locks, before the new file replaces the old one. The kept rows are
+# (row id in segment, csv.DictReader row) and become the first rows of the
+# new segment, in the same order.
+CompactHook = Callable[[int, int, List[Tuple[int, dict]]], None]
+
+_compact_hooks: Dict[str, List[CompactHook]] = {}
+
+
+class StaleSegmentError(Exception):
+    """A listing id refers to a CSV file that has since been compacted."""
+
+
+def on_compact(csv_filename: str, hook: CompactHook):
+    """Call hook whenever this process compacts the file, e.g. to carry row positions over."""
+    _compact_hooks.setdefault(os.path.abspath(csv_filename), []).append(hook)
+
+
+def tombstone_path(csv_filename: str) -> str:
+    return csv_filename + ".tombstones"
+
+
+def rejected_path(csv_filename: str) -> str:
+    return csv_filename + ".rejected"
+
+
+def listing_id(segment: int, row_id: int) -> str:
+    """The id clients use for a row of one segment."""
+    return f"{segment}-{row_id}"
+
+
+def parse_listing_id(value: str) -> Tuple[int, int]:
+    """(segment, row id) of a listing id; raises ValueError for anything else."""
+    segment, _, row_id = value.partition("-")
+    return int(segment), int(row_id)
+
+
+@contextmanager
+def _locked(path: str, operation: int, create: bool = False) -> Iterator[Optional[int]]:
+    """Open and flock a file, reopening it if it was replaced while we waited.
+
+    Yields None if the file doesn't exist and create is not set.
+    """
+    while True:
+        try:
+            fd = os.open(path, os.O_RDWR | (os.O_CREAT if create else 0), 0o644)
+        except FileNotFoundError:
+            yield None
+            return
+        if fcntl is not None:
+            fcntl.flock(fd, operation)
+        try:
+            current = os.stat(path).st_ino
+        except FileNotFoundError:
+            current = None
+        if current == os.fstat(fd).st_ino:
+            break
+        os.close(fd)
+    try:
+        yield fd
+    finally:
+        # Closing the descriptor also releases the flock
+        os.close(fd)
+
+
+def _read_all(fd: int) -> bytes:
+    os.lseek(fd, 0, os.SEEK_SET)
+    chunks = []
+    while True:
+        chunk = os.read(fd, 1 << 20)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def _write_all(fd: int, data: bytes):
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def _header(segment: int, inode: int) -> bytes:
+    return f"segment {segment} {inode}\n".encode()
+
+
+def _parse_header(data: bytes) -> Tuple[int, Optional[int]]:
+    """(segment, inode of its CSV) from the start of a tombstone file; (0, None) without a header."""
+    fields = data[:data.find(b"\n")].split()
+    if len(fields) != 3 or fields[0] != b"segment":
+        return 0, None
+    try:
+        return int(fields[1]), int(fields[2])
+    except ValueError:
+        return 0, None
+
+
+def _parse_tombstones(data: bytes, segment: int, offset: int = 0) -> Tuple[List[int], int]:
+    """Row ids recorded after offset, and the offset to continue from."""
+    newline = data.find(b"\n")
+    if newline < 0 or _parse_header(data)[0] != segment:
+        return [], 0  # Missing, or written for another segment
+    offset = max(offset, newline + 1)
+    end = data.rfind(b"\n") + 1
+    rows = [int(line) for line in data[offset:end].split()]
+    return rows, max(offset, end)
+
+
+def _inode(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def read_tombstones(csv_filename: str, segment: int, offset: int = 0) -> Tuple[List[int], int]:
+    """Rows of a segment deleted since offset; returns (row ids, new offset)."""
+    with _locked(tombstone_path(csv_filename), fcntl.LOCK_SH if fcntl else 0) as fd:
+        if fd is None:
+            return [], 0
+        return _parse_tombstones(_read_all(fd), segment, offset)
+
+
+def read_segment(csv_filename: str) -> Optional[int]:
+    """The segment the CSV currently is, or None if no tombstone header names it yet."""
+    with _locked(tombstone_path(csv_filename), fcntl.LOCK_SH if fcntl else 0) as fd:
+        if fd is None:
+            return None
+        segment, inode = _parse_header(_read_all(fd))
+        if inode is None or inode != _inode(csv_filename):
+            return None
+        return segment
+
+
+def _claim_segment(fd: int, inode: int) -> int:
+    """Segment of the CSV with this inode, starting the next one if the header is another file's."""
+    segment, header_inode = _parse_header(_read_all(fd))
+    if header_inode != inode:
+        segment += 1
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        _write_all(fd, _header(segment, inode))
+        os.fsync(fd)
+    return segment
+
+
+class Tombstones:
+    """The tombstone file of a CSV, held under an exclusive lock."""
+
+    def __init__(self, fd: int, segment: int):
+        self.fd = fd
+        self.segment = segment
+
+    def rows(self) -> List[int]:
+        """Row ids deleted so far, including by other processes."""
+        return _parse_tombstones(_read_all(self.fd), self.segment)[0]
+
+    def delete(self, row_ids: Iterable[int]):
+        data = "".join(f"{row_id}\n" for row_id in row_ids).encode()
+        if not data:
+            return
+        os.lseek(self.fd, 0, os.SEEK_END)
+        _write_all(self.fd, data)
+        os.fsync(self.fd)
+        TOMBSTONES.inc(data.count(b"\n"))
+
+
+@contextmanager
+def current_segment(csv_filename: str) -> Iterator[Optional[Tombstones]]:
+    """Lock the tombstone file for the CSV as it is now.
+
+    Compaction can't replace the CSV while it is held, so rows read from it
+    meanwhile belong to the yielded segment. Yields None if there is no CSV.
+    """
+    with _locked(tombstone_path(csv_filename), fcntl.LOCK_EX if fcntl else 0, create=True) as fd:
+        inode = _inode(csv_filename)
+        if inode is None:
+            yield None
+        else:
+            yield Tombstones(fd, _claim_segment(fd, inode))
+
+
+@contextmanager
+def open_tombstones(csv_filename: str, segment: int) -> Iterator[Tombstones]:
+    """Lock the tombstone file for rows of segment.
+
+    Compaction can't run while it is held, so an update may append the new
+    row before recording the delete and never lose the listing. Raises
+    StaleSegmentError if the CSV is no longer that segment.
+    """
+    with current_segment(csv_filename) as tombstones:
+        if tombstones is None or tombstones.segment != segment:
+            raise StaleSegmentError(f"{csv_filename} was compacted, listing ids have changed")
+        yield tombstones
+
+
+def delete_rows(csv_filename: str, segment: int, row_ids: Iterable[int]):
+    with open_tombstones(csv_filename, segment) as tombstones:
+        tombstones.delete(row_ids)
+
+
+def well_formed(row: dict) -> bool:
+    """Whether a csv.DictReader row has exactly the header's fields and a cost that is blank or a number."""
+    if None in row or None in row.values():  # Too many or too few cells
+        return False
+    if row.get("cst"):  # NewPost3.py writes a blank cost when none was given
+        try:
+            int(row["cst"])
+        except ValueError:
+            return False
+    return True
+
+
+def compact(csv_filename: str) -> Dict[str, int]:
+    """Rewrite the CSV without tombstoned and malformed rows; returns what was dropped."""
+    stats = {"rows": 0, "deleted": 0, "malformed": 0, "bytes_before": 0, "bytes_after": 0}
+    with _locked(tombstone_path(csv_filename), fcntl.LOCK_EX if fcntl else 0, create=True) as tombstone_fd, \
+            _locked(csv_filename, fcntl.LOCK_EX if fcntl else 0) as csv_fd:
+        if csv_fd is None:
+            return stats
+        segment = _claim_segment(tombstone_fd, os.fstat(csv_fd).st_ino)
+        deleted = set(_parse_tombstones(_read_all(tombstone_fd), segment)[0])
+        data = _read_all(csv_fd)
+        stats["bytes_before"] = len(data)
+        reader = csv.DictReader(io.StringIO(data.decode("utf-8"), newline=''))
+        kept = []
+        rejected = []
+        for row_id, row in enumerate(reader):
+            if row_id in deleted:
+                stats["deleted"] += 1
+            elif well_formed(row):
+                kept.append((row_id, row))
+            else:
+                rejected.append(row)
+        stats["rows"] = len(kept)
+        stats["malformed"] = len(rejected)
+        if not deleted and not rejected:
+            stats["bytes_after"] = len(data)
+            return stats
+
+        fieldnames = reader.fieldnames or []
+        if rejected:
+            with open(rejected_path(csv_filename), "a", newline='', encoding="utf-8") as file:
+                writer = csv.writer(file)
+                for row in rejected:
+                    writer.writerow([row.get(field) or "" for field in fieldnames] + row.get(None, []))
+
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(row for _, row in kept)
+        compacted = output.getvalue().encode("utf-8")
+        stats["bytes_after"] = len(compacted)
+
+        temporary = csv_filename + ".compact"
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            _write_all(fd, compacted)
+            os.fsync(fd)
+            inode = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+        tombstone_temporary = tombstone_path(csv_filename) + ".compact"
+        with open(tombstone_temporary, "wb") as file:
+            file.write(_header(segment + 1, inode))
+            file.flush()
+            os.fsync(file.fileno())
+        for hook in _compact_hooks.get(os.path.abspath(csv_filename), ()):
+            hook(segment, segment + 1, kept)
+        # A crash between the two leaves a header naming the old inode; the
+        # next writer then starts segment + 1 with no tombstones
+        os.replace(temporary, csv_filename)
+        os.replace(tombstone_temporary, tombstone_path(csv_filename))
+    COMPACTIONS.inc()
+    return stats
+
+
+def garbage_fraction(csv_filename: str) -> float:
+    """Share of the CSV's rows that are tombstoned."""
+    segment = read_segment(csv_filename)
+    if segment is None:
+        return 0.0  # Nothing deleted from this file yet
+    try:
+        with open(csv_filename, "rb") as file:
+            rows = file.read().count(b"\n") - 1
+    except FileNotFoundError:
+        return 0.0
+    deleted = len(set(read_tombstones(csv_filename, segment)[0]))
+    return deleted / rows if rows > 0 else 0.0
+
+
+class Compactor:
+    """Background thread compacting a CSV once enough of it is tombstoned."""
+
+    def __init__(self, csv_filename: str, interval: float = 300.0, fraction: float = COMPACT_FRACTION):
+        self.csv_filename = csv_filename
+        self.interval = interval
+        self.fraction = fraction
+        self.runs = 0
+        self.last: Optional[Dict[str, int]] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="listing-compactor", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if garbage_fraction(self.csv_filename) >= self.fraction:
+                    self.last = compact(self.csv_filename)
+                    self.runs += 1
+            except Exception as e:
+                print(f"Compacting {self.csv_filename} failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+# One compactor per file for the whole process
+_compactors: Dict[str, Compactor] = {}
+_compactors_lock = threading.Lock()
+
+
+def get_compactor(csv_filename: str, **options) -> Compactor:
+    """Return the process-wide compactor for a file, starting it on first use."""
+    key = os.path.abspath(csv_filename)
+    with _compactors_lock:
+        compactor = _compactors.get(key)
+        if compactor is None:
+            compactor = Compactor(csv_filename, **options)
+            _compactors[key] = compactor
+        return compactor
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python listing_log.py user_data.csv")
+        sys.exit(1)
+    result = compact(sys.argv[1])
+    print(f"Kept {result['rows']} listings, dropped {result['deleted']} deleted and "
+          f"{result['malformed']} malformed rows ({result['bytes_before']} -> {result['bytes_after']} bytes)")
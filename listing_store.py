@@ -0,0 +1,274 @@
+import csv
+import io
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import listing_log
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; see post_writer.py
+    fcntl = None
+
+# A loader turns a CSV filename into the list of parsed listings,
+# e.g. read_user_data in test1.py or read_user_data_from_csv in UBC Sublet.py
+Loader = Callable[[str], List]
+
+# (mtime, size, inode) of the file when it was last read
+Signature = Tuple[int, int, int]
+
+
+class CsvLoader:
+    """Loader that can also read only the rows appended after a byte offset.
+
+    Only complete lines are consumed, and the file is read under a shared
+    flock so a group commit from post_writer.py is never seen half-written.
+    """
+
+    def __init__(self, parse_row: Callable[[dict], Any]):
+        self.parse_row = parse_row
+
+    def __call__(self, filename: str) -> List:
+        return self.read(filename)[0]
+
+    def read(self, filename: str, offset: int = 0,
+             fieldnames: Optional[List[str]] = None) -> Tuple[List, int, Optional[List[str]]]:
+        """Parse the rows after offset; returns (listings, new offset, header)."""
+        try:
+            file = open(filename, 'rb')
+        except FileNotFoundError:
+            return [], 0, None
+        with file:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_SH)
+            file.seek(offset)
+            data = file.read()
+        # Leave a trailing partial line for the next read
+        end = data.rfind(b"\n") + 1
+        reader = csv.DictReader(io.StringIO(data[:end].decode('utf-8'), newline=''), fieldnames=fieldnames)
+        listings = [self.parse_row(row) for row in reader]
+        return listings, offset + end, reader.fieldnames
+
+
+class ListingStore:
+    """Keeps the parsed listings of one CSV file in memory.
+
+    The file is only re-parsed when its modification time or size changes, so
+    repeated reads cost one os.stat() instead of a full CSV parse. With a
+    CsvLoader, a file that only grew is tailed instead: just the new bytes are
+    parsed, appended to the listings and added to the derived indexes.
+
+    Rows deleted through listing_log.py stay in the listings list, so row ids
+    don't move, but are added to deleted and removed from the derived
+    indexes; live() returns only the rest. Row ids belong to a segment of
+    the file (see listing_log.py): the store reloads instead of tailing once
+    the file was compacted. Other loaders are reloaded when the tombstone
+    file changes and must leave deleted rows out themselves, as
+    snapshot.load_snapshot does.
+    """
+
+    def __init__(self, filename: str, loader: Loader):
+        self.filename = filename
+        self.loader = loader
+        self.listings: List = []
+        self.row_count = 0  # Rows currently held
+        self.load_seconds = 0.0  # Time spent in the last full load
+        self.loads = 0  # Number of times the whole file has been parsed
+        self.appends = 0  # Number of incremental reads of appended rows
+        self.generation = 0  # Bumped whenever the listings change
+        self.segment: Optional[int] = None  # Segment of the CSV the row ids refer to (CsvLoader only)
+        self.deleted: Set[int] = set()  # Tombstoned row ids (CsvLoader only)
+        self._signature: Optional[Signature] = None
+        self._tombstones: Optional[Signature] = None
+        self._tombstone_offset = 0
+        self._pending_deletes: Set[int] = set()  # Tombstones for rows not read yet
+        self._offset = 0  # Bytes of the file already parsed (CsvLoader only)
+        self._fieldnames: Optional[List[str]] = None
+        self._loaded = False
+        self._derived: Dict[str, Any] = {}  # Indexes built over the current listings
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature_of(filename: str) -> Optional[Signature]:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _file_signature(self) -> Optional[Signature]:
+        return self._signature_of(self.filename)
+
+    def get(self) -> List:
+        """Return the current listings, reloading first if the file has changed."""
+        signature = self._file_signature()
+        tombstones = self._signature_of(listing_log.tombstone_path(self.filename))
+        if not self._loaded or signature != self._signature or tombstones != self._tombstones:
+            with self._lock:
+                # Another thread may have reloaded while we waited for the lock
+                if not self._loaded or signature != self._signature:
+                    if self._can_tail(signature, tombstones):
+                        self._tail(signature)
+                    else:
+                        self._load(signature)
+                elif tombstones != self._tombstones and not self._same_segment():
+                    self._load(signature)
+                if tombstones != self._tombstones:
+                    self._tombstones = tombstones
+                    if isinstance(self.loader, CsvLoader):
+                        self._read_tombstones()
+        return self.listings
+
+    def live(self) -> Sequence:
+        """The listings that haven't been deleted, in row order."""
+        # A tuple, not a list: list.remove would be taken for an index's remove()
+        return self.derived("live", lambda listings: tuple(
+            listing for row_id, listing in enumerate(listings) if row_id not in self.deleted))
+
+    def _same_segment(self) -> bool:
+        # Compaction rewrites the tombstone file, so it only needs checking when that changed
+        return isinstance(self.loader, CsvLoader) and listing_log.read_segment(self.filename) == self.segment
+
+    def _can_tail(self, signature: Optional[Signature], tombstones: Optional[Signature]) -> bool:
+        # Only a file that was appended to: same inode and segment, not shorter
+        # than what we read. The inode alone may be a reused one.
+        return (
+            self._loaded
+            and isinstance(self.loader, CsvLoader)
+            and self._fieldnames is not None
+            and signature is not None
+            and self._signature is not None
+            and signature[2] == self._signature[2]
+            and signature[1] >= self._offset
+            and (tombstones == self._tombstones or self._same_segment())
+        )
+
+    def _load(self, signature: Optional[Signature]):
+        start = time.perf_counter()
+        self.segment = None
+        if isinstance(self.loader, CsvLoader):
+            # Compaction can't replace the file while its segment is held
+            with listing_log.current_segment(self.filename) as tombstones:
+                signature = self._file_signature()
+                if tombstones is not None:
+                    self.segment = tombstones.segment
+                listings, self._offset, self._fieldnames = self.loader.read(self.filename)
+        else:
+            listings = self.loader(self.filename)
+        self.load_seconds = time.perf_counter() - start
+        metrics.STAGE_SECONDS.observe(self.load_seconds, stage="csv_load")
+        self.listings = listings
+        self.row_count = len(listings)
+        self.loads += 1
+        self.generation += 1
+        self._signature = signature
+        self._loaded = True
+        self._derived = {}
+        self.deleted = set()
+        self._pending_deletes = set()
+        self._tombstones = None  # Read the whole tombstone file again
+        self._tombstone_offset = 0
+
+    def _tail(self, signature: Signature):
+        with metrics.STAGE_SECONDS.time(stage="csv_tail"):
+            listings, self._offset, _ = self.loader.read(self.filename, self._offset, self._fieldnames)
+        self._signature = signature
+        self.appends += 1
+        self._append(listings)
+
+    def _append(self, listings: List):
+        if not listings:
+            return
+        for listing in listings:
+            row_id = len(self.listings)
+            self.listings.append(listing)
+            # Indexes that know how to add a row are kept; the rest are rebuilt on next use
+            for name, value in list(self._derived.items()):
+                if hasattr(value, "add"):
+                    value.add(row_id, listing)
+                else:
+                    del self._derived[name]
+        self.row_count = len(self.listings)
+        self.generation += 1
+        if self._pending_deletes:
+            self._delete(())
+
+    def _read_tombstones(self):
+        if self.segment is None:
+            return
+        rows, self._tombstone_offset = listing_log.read_tombstones(
+            self.filename, self.segment, self._tombstone_offset)
+        self._delete(rows)
+
+    def _delete(self, row_ids):
+        deleted = False
+        pending = set()
+        for row_id in sorted(set(row_ids) | self._pending_deletes):
+            if row_id >= len(self.listings):
+                # Appended and deleted since the file was last tailed
+                pending.add(row_id)
+                continue
+            if row_id in self.deleted:
+                continue
+            self.deleted.add(row_id)
+            deleted = True
+            listing = self.listings[row_id]
+            # Indexes that know how to remove a row are kept; the rest are rebuilt on next use
+            for name, value in list(self._derived.items()):
+                if hasattr(value, "remove"):
+                    value.remove(row_id, listing)
+                else:
+                    del self._derived[name]
+        self._pending_deletes = pending
+        if deleted:
+            self.generation += 1
+
+    def derived(self, name: str, build: Callable[[List], Any]) -> Any:
+        """Return a structure built from the current listings, e.g. an index.
+
+        It is built on first use and thrown away whenever the file is fully
+        reloaded. If it has an add(row_id, listing) method it is kept up to
+        date with appended rows instead, and likewise remove(row_id, listing)
+        for deleted rows. build gets every row, deleted ones included.
+        """
+        self.get()
+        with self._lock:
+            value = self._derived.get(name)
+            if value is None:
+                value = build(self.listings)
+                if hasattr(value, "remove"):
+                    for row_id in sorted(self.deleted):
+                        value.remove(row_id, self.listings[row_id])
+                self._derived[name] = value
+            return value
+
+    def stats(self) -> dict:
+        """Report what the last load cost."""
+        return {
+            "filename": self.filename,
+            "row_count": self.row_count,
+            "load_seconds": self.load_seconds,
+            "loads": self.loads,
+            "appends": self.appends,
+            "generation": self.generation,
+            "deleted": len(self.deleted),
+        }
+
+
+# One store per (file, loader) for the whole process
+_stores: Dict[Tuple[str, Loader], ListingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(filename: str, loader: Loader) -> ListingStore:
+    """Return the process-wide store for a file, creating it on first use."""
+    key = (os.path.abspath(filename), loader)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = ListingStore(filename, loader)
+            _stores[key] = store
+        return store
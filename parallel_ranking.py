@@ -0,0 +1,145 @@
+"""Ranking split over a pool of worker processes.
+
+The listings are cut into contiguous shards of a snapshot.Snapshot. Each
+worker maps the snapshot file itself, so no rows are pickled: it is sent the
+snapshot path, the filters and a row range, and sends back the sort keys and
+row ids of the shard's first offset + limit listings. The shard results are
+then k-way merged. Within a shard ties keep their row order and the merge
+prefers earlier shards, so the result is identical to
+rank_and_sort_all_features over the whole snapshot.
+"""
+import heapq
+import itertools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple
+
+import columnar
+from ranking import make_sort_key
+from snapshot import Snapshot
+
+# Below this many rows per worker the pool costs more than it saves
+MIN_SHARD_ROWS = 50_000
+
+# Snapshots already mapped by this worker process, by path
+_snapshots: Dict[str, Tuple[Snapshot, Optional[columnar.ListingColumns]]] = {}
+
+
+class SnapshotChangedError(Exception):
+    """The snapshot file was recompiled from another version of the CSV than the one asked for."""
+
+
+def _open(path: str, source: Optional[dict]) -> Tuple[Snapshot, Optional[columnar.ListingColumns]]:
+    cached = _snapshots.get(path)
+    # A recompiled snapshot replaces the file, so compare what it was built from
+    if cached is None or cached[0].source != source:
+        snapshot = Snapshot(path)
+        if snapshot.source != source:
+            # Its rows aren't those of the caller's snapshot, so neither would the row ids be
+            raise SnapshotChangedError(f"{path} was recompiled since it was mapped")
+        columns = columnar.ListingColumns.from_snapshot(snapshot) if columnar.available() else None
+        cached = _snapshots[path] = (snapshot, columns)
+    return cached
+
+
+def rank_shard(path: str, source: Optional[dict], filters: dict, start: int, stop: int,
+               count: Optional[int]) -> List[tuple]:
+    """Rank rows start..stop of a snapshot and return the first count of them.
+
+    With numpy each item is (primary key, ..., last key, row id) and the list
+    is ascending; without it each item is (sort key, row id) and the list is
+    in the descending order of rank_and_sort_all_features. Raises
+    SnapshotChangedError if the file at path is no longer built from source.
+    """
+    snapshot, columns = _open(path, source)
+    return _rank_rows(snapshot, columns, filters, start, stop, count)
+
+
+def _rank_rows(snapshot: Snapshot, columns: Optional[columnar.ListingColumns], filters: dict,
+               start: int, stop: int, count: Optional[int]) -> List[tuple]:
+    if columns is not None:
+        np = columnar.np
+        keys = columns.shard(start, stop).sort_keys(filters)
+        # Selects the shard's first count rows without sorting the rest
+        rows = np.lexsort(keys) if count is None else columnar.top_rows(keys, count)
+        return np.column_stack([key[rows] for key in reversed(keys)] + [rows + start]).tolist()
+    sort_key = make_sort_key(filters)
+    keyed = [(sort_key(snapshot[row]), row) for row in range(start, stop)]
+    if count is None:
+        return sorted(keyed, key=itemgetter(0), reverse=True)
+    return heapq.nlargest(count, keyed, key=itemgetter(0))
+
+
+def shard_bounds(rows: int, shards: int) -> List[Tuple[int, int]]:
+    """Split range(rows) into at most shards contiguous, nearly equal ranges."""
+    shards = max(1, min(shards, rows))
+    size, extra = divmod(rows, shards)
+    bounds = []
+    start = 0
+    for shard in range(shards):
+        stop = start + size + (1 if shard < extra else 0)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+class ShardedRanker:
+    """Ranks a snapshot's listings in a process pool.
+
+    workers defaults to the number of CPUs. The pool is started on first use
+    and shared by all calls; snapshots with fewer than MIN_SHARD_ROWS rows
+    per worker use fewer shards, down to ranking in this process.
+    """
+
+    def __init__(self, workers: Optional[int] = None, min_shard_rows: int = MIN_SHARD_ROWS):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_shard_rows = min_shard_rows
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def order(self, snapshot: Snapshot, filters: Optional[dict] = None,
+              limit: Optional[int] = None, offset: int = 0) -> List[int]:
+        """Row ids of the snapshot in ranked order, optionally only one page."""
+        filters = filters or {}
+        count = None if limit is None else offset + limit
+        shards = shard_bounds(len(snapshot), min(self.workers, len(snapshot) // self.min_shard_rows))
+        tasks = [(snapshot.path, snapshot.source, filters, start, stop, count) for start, stop in shards]
+        try:
+            if len(tasks) == 1:
+                results = [rank_shard(*tasks[0])]
+            else:
+                pool = self._get_pool()
+                results = list(pool.map(rank_shard, *zip(*tasks)))
+        except SnapshotChangedError:
+            # Recompiled after we mapped it: rank the rows we hold in this process
+            columns = columnar.ListingColumns.from_snapshot(snapshot) if columnar.available() else None
+            results = [_rank_rows(snapshot, columns, filters, start, stop, count) for start, stop in shards]
+
+        if columnar.available():
+            # Ascending tuples ending in the row id: plain tuple order
+            merged = heapq.merge(*results)
+            row_ids = (int(item[-1]) for item in merged)
+        else:
+            # heapq.merge takes equal keys from earlier shards first
+            merged = heapq.merge(*results, key=itemgetter(0), reverse=True)
+            row_ids = (row for _, row in merged)
+        return list(itertools.islice(row_ids, offset, count))
+
+    def rank(self, snapshot: Snapshot, filters: Optional[dict] = None,
+             limit: Optional[int] = None, offset: int = 0) -> List:
+        """Ranked listings, the same as rank_and_sort_all_features(list(snapshot), ...)."""
+        return [snapshot[row] for row in self.order(snapshot, filters, limit, offset)]
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
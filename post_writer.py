@@ -0,0 +1,175 @@
+import atexit
+import csv
+import io
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; posts are then only serialized within one process
+    fcntl = None
+
+
+class PendingPost:
+    """Rows from one submit, waiting for their group commit."""
+
+    __slots__ = ("rows", "done", "error")
+
+    def __init__(self, rows: List[dict]):
+        self.rows = rows
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class GroupCommitWriter:
+    """Appends posted rows to a CSV file from a single writer thread.
+
+    Rows that queue up while the previous batch is being written, plus any
+    arriving within flush_interval seconds (up to max_batch submits in
+    total), are written with one locked append and, if fsync is set, one
+    fsync. The file
+    is locked with flock for the duration of the append, so several worker
+    processes can share the file without interleaving partial rows or writing
+    the header twice.
+    """
+
+    def __init__(self, filename: str, fieldnames: Sequence[str], flush_interval: float = 0.0,
+                 max_batch: int = 256, fsync: bool = True):
+        self.filename = filename
+        self.fieldnames = list(fieldnames)
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.commits = 0  # Number of group commits written
+        self.rows_written = 0
+        self._queue: "queue.Queue[Optional[PendingPost]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="post-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, row: dict, timeout: Optional[float] = None):
+        """Queue a row and block until it has been written (and fsynced)."""
+        self.submit_many([row], timeout)
+
+    def submit_many(self, rows: List[dict], timeout: Optional[float] = None):
+        """Queue several rows to be written in the same append, and block until they are."""
+        if not rows:
+            return
+        pending = PendingPost(rows)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError("Post was not written in time")
+        if pending.error is not None:
+            raise pending.error
+
+    def close(self):
+        """Write whatever is still queued and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            # Posts that queued up during the previous commit go out together;
+            # flush_interval optionally lingers for more before writing
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        pending = self._queue.get(timeout=remaining)
+                    else:
+                        pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    running = False
+                    break
+                batch.append(pending)
+            self._commit(batch)
+
+    def _commit(self, batch: List[PendingPost]):
+        try:
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=self.fieldnames)
+            for pending in batch:
+                writer.writerows(pending.rows)
+            self._append(buffer.getvalue(), writer)
+            self.commits += 1
+            self.rows_written += sum(len(pending.rows) for pending in batch)
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        for pending in batch:
+            pending.done.set()
+
+    def _append(self, rows: str, writer: csv.DictWriter):
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        while True:
+            fd = os.open(self.filename, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            # Compaction (listing_log.py) may have replaced the file while we
+            # waited for the lock; append to the new one instead
+            try:
+                if os.stat(self.filename).st_ino == os.fstat(fd).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+        try:
+            # Decide on the header only while holding the lock
+            size = os.fstat(fd).st_size
+            prefix = ""
+            if size == 0:
+                header = io.StringIO()
+                csv.DictWriter(header, fieldnames=self.fieldnames, lineterminator=writer.writer.dialect.lineterminator).writeheader()
+                prefix = header.getvalue()
+            else:
+                # A file not ending in a newline would glue our first row onto its last one
+                os.lseek(fd, size - 1, os.SEEK_SET)
+                if os.read(fd, 1) not in (b"\n", b"\r"):
+                    prefix = writer.writer.dialect.lineterminator
+            data = (prefix + rows).encode("utf-8")
+            while data:
+                written = os.write(fd, data)
+                data = data[written:]
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            # Closing the descriptor also releases the flock
+            os.close(fd)
+
+    def stats(self) -> dict:
+        return {
+            "filename": self.filename,
+            "commits": self.commits,
+            "rows_written": self.rows_written,
+            "queued": self._queue.qsize(),
+        }
+
+
+# One writer per file for the whole process
+_writers: Dict[str, GroupCommitWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(filename: str, fieldnames: Sequence[str], **options) -> GroupCommitWriter:
+    """Return the process-wide writer for a file, starting it on first use."""
+    key = os.path.abspath(filename)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = GroupCommitWriter(filename, fieldnames, **options)
+            _writers[key] = writer
+            atexit.register(writer.close)
+        return writer
@@ -0,0 +1,323 @@
+"""Compiles filter dicts into query plans over a ListingIndex.
+
+ColumnStats counts the values of every field when the listings are loaded
+and as rows are appended. A plan orders the predicates by how many rows they
+are estimated to keep, answers the selective ones with an index lookup and
+checks the rest only on the rows the lookups left, the most selective first,
+so a predicate that leaves nothing stops the query right away.
+
+Plans are compiled once per distinct filter dict (normally at POST /filters)
+and cached; they give the same rows, in the same order, as
+ListingIndex.match_rows.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import geo
+import metrics
+from listing import LISTING_FIELDS
+from listing_index import (BITMAP_FIELDS, RANGE_FIELDS, ListingIndex, bits_from_rows, field_value, iter_bits,
+                           parse_range_key, plain_value, predicate_matches, rows_from_bits)
+from result_cache import normalize_filters
+
+# Fields with value counts; descriptions are free text and never filtered on,
+# while the lease fields parsed from length are
+STATS_FIELDS = tuple(field for field in LISTING_FIELDS if field != "descr") + (
+    "lease_months", "lease_start", "lease_end")
+
+# Rough relative costs, per row: checking predicates on one listing in
+# Python, turning one row id from a range index into a bit, and ANDing a
+# bitmap (which works on machine words, so a small fraction per row)
+SCAN_COST = 4.0
+RANGE_ROW_COST = 1.0
+BITMAP_ROW_COST = 1 / 64
+
+# Cached plans are recompiled once the table has grown or shrunk this much
+RECOMPILE_FACTOR = 2
+
+
+class ColumnStats:
+    """Value counts per field, kept up to date as rows are appended and deleted."""
+
+    def __init__(self, listings: List):
+        self.rows = 0
+        self.counts: Dict[str, Dict[Any, int]] = {field: {} for field in STATS_FIELDS + ("place_id",)}
+        # field -> (sorted distinct values, running totals), rebuilt after adds
+        self._cumulative: Dict[str, Tuple[List, List[int]]] = {}
+        for row_id, listing in enumerate(listings):
+            self.add(row_id, listing)
+
+    def add(self, row_id: int, listing):
+        self.rows += 1
+        for field in STATS_FIELDS:
+            counts = self.counts[field]
+            value = field_value(listing, field)
+            counts[value] = counts.get(value, 0) + 1
+        places = self.counts["place_id"]
+        place = geo.place_id(listing)
+        places[place] = places.get(place, 0) + 1
+        self._cumulative.clear()
+
+    def remove(self, row_id: int, listing):
+        self.rows -= 1
+        for field in STATS_FIELDS:
+            counts = self.counts[field]
+            value = field_value(listing, field)
+            counts[value] -= 1
+            if not counts[value]:
+                del counts[value]
+        places = self.counts["place_id"]
+        place = geo.place_id(listing)
+        places[place] -= 1
+        if not places[place]:
+            del places[place]
+        self._cumulative.clear()
+
+    def count_equal(self, field: str, value) -> int:
+        counts = self.counts.get(field)
+        if counts is None:
+            return self.rows // 2  # No statistics: assume half
+        return counts.get(plain_value(value), 0)
+
+    def count_between(self, field: str, low=None, high=None) -> int:
+        """Rows with low <= value <= high; a None bound is open."""
+        cumulative = self._cumulative.get(field)
+        if cumulative is None:
+            counts = self.counts.get(field)
+            if counts is None:
+                return self.rows // 2
+            values = sorted(value for value in counts if value is not None and not isinstance(value, bool))
+            totals = []
+            total = 0
+            for value in values:
+                total += counts[value]
+                totals.append(total)
+            cumulative = self._cumulative[field] = (values, totals)
+        values, totals = cumulative
+        start = bisect_left(values, low) if low is not None else 0
+        end = bisect_right(values, high) if high is not None else len(values)
+        if end <= start:
+            return 0
+        return totals[end - 1] - (totals[start - 1] if start else 0)
+
+
+class PlanStep:
+    """The predicates on one field and how they are evaluated.
+
+    access is "bitmap" or "range" for an index lookup and "scan" for a
+    check of each remaining row. A within_km radius is a scan step holding
+    the geo.GeoQuery.
+    """
+
+    __slots__ = ("field", "predicates", "access", "estimate", "geo_query")
+
+    def __init__(self, field: str, predicates: List[Tuple[str, Any]], access: str, estimate: int,
+                 geo_query: Optional[geo.GeoQuery] = None):
+        self.field = field
+        self.predicates = predicates
+        self.access = access
+        self.estimate = estimate  # Rows of the whole table this step keeps
+        self.geo_query = geo_query
+
+    def matches(self, listing) -> bool:
+        if self.geo_query is not None:
+            return self.geo_query.matches(listing)
+        return all(predicate_matches(listing, key, value) for key, value in self.predicates)
+
+    def bounds(self) -> Tuple[Any, Any]:
+        """(low, high) for a range lookup; an equality is low == high."""
+        low = high = None
+        for key, value in self.predicates:
+            range_key = parse_range_key(key)
+            if range_key is None:
+                low = high = value
+            elif range_key[1] == "min":
+                low = value
+            else:
+                high = value
+        return low, high
+
+    def lookup(self, index: ListingIndex) -> int:
+        if self.access == "bitmap":
+            return index.bitmaps[self.field].lookup(plain_value(self.predicates[0][1]))
+        low, high = self.bounds()
+        return bits_from_rows(index.ranges[self.field].rows_between(low, high), len(index.listings))
+
+    def describe(self) -> str:
+        if self.geo_query is not None:
+            return f"within {self.geo_query.within_km:g} km of {self.geo_query.near!r}"
+        parts = []
+        for key, value in self.predicates:
+            range_key = parse_range_key(key)
+            if range_key is None:
+                parts.append(f"{key} == {plain_value(value)!r}")
+            else:
+                parts.append(f"{range_key[0]} {'>=' if range_key[1] == 'min' else '<='} {value!r}")
+        return " and ".join(parts)
+
+
+class QueryPlan:
+    """Index lookups to AND together, then predicates to check on what is left."""
+
+    def __init__(self, filters: dict, lookups: List[PlanStep], scans: List[PlanStep], rows: int):
+        self.filters = filters
+        self.lookups = lookups
+        self.scans = scans
+        self.compiled_rows = rows  # Table size the estimates were made for
+
+    def _candidates(self, index: ListingIndex) -> int:
+        bits = index.live_bits()
+        for step in self.lookups:
+            bits &= step.lookup(index)
+            if not bits:
+                break
+        return bits
+
+    def execute(self, index: ListingIndex) -> List[int]:
+        """Ids of the matching rows, in row order."""
+        rows = rows_from_bits(self._candidates(index))
+        if self.scans and rows:
+            metrics.ROWS_SCANNED.inc(len(rows))
+            listings = index.listings
+            scans = self.scans
+            rows = [row_id for row_id in rows if all(step.matches(listings[row_id]) for step in scans)]
+        return rows
+
+    def iter_rows(self, index: ListingIndex, start: int = 0) -> Iterator[int]:
+        """Lazily yield the matching row ids from start on, in row order."""
+        bits = self._candidates(index)
+        listings = index.listings
+        scans = self.scans
+        for row_id in iter_bits(bits >> start):
+            row_id += start
+            if all(step.matches(listings[row_id]) for step in scans):
+                yield row_id
+
+    def explain(self, index: ListingIndex) -> dict:
+        """Run the plan one step at a time, reporting estimated and actual rows after each."""
+        bits = index.live_bits()
+        total = bits.bit_count()
+        estimate = float(self.compiled_rows)
+        steps = []
+        for step in self.lookups:
+            bits &= step.lookup(index)
+            estimate *= step.estimate / self.compiled_rows if self.compiled_rows else 0
+            steps.append(self._explain_step(step, estimate, bits.bit_count()))
+        rows = rows_from_bits(bits)
+        listings = index.listings
+        for step in self.scans:
+            rows = [row_id for row_id in rows if step.matches(listings[row_id])]
+            estimate *= step.estimate / self.compiled_rows if self.compiled_rows else 0
+            steps.append(self._explain_step(step, estimate, len(rows)))
+        return {
+            "filters": dict(normalize_filters(self.filters)),
+            "rows": total,
+            "steps": steps,
+            "estimated_rows": round(estimate),
+            "actual_rows": len(rows),
+        }
+
+    @staticmethod
+    def _explain_step(step: PlanStep, estimate: float, actual: int) -> dict:
+        return {
+            "predicate": step.describe(),
+            "access": step.access,
+            "estimated_rows": round(estimate),
+            "actual_rows": actual,
+        }
+
+
+class QueryPlanner:
+    """Compiles and caches plans for one table.
+
+    Works as a ListingStore derived structure built from the listings: add()
+    and remove() keep the statistics current, and a full reload builds a new
+    planner with fresh statistics and an empty cache.
+    """
+
+    def __init__(self, listings: List, max_plans: int = 256):
+        self.stats = ColumnStats(listings)
+        self.max_plans = max_plans
+        self.hits = 0
+        self.misses = 0
+        self._plans: "OrderedDict[Tuple, QueryPlan]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, row_id: int, listing):
+        with self._lock:
+            self.stats.add(row_id, listing)
+
+    def remove(self, row_id: int, listing):
+        with self._lock:
+            self.stats.remove(row_id, listing)
+
+    def plan(self, filters: Optional[dict]) -> QueryPlan:
+        """The cached plan for these filters, compiling it on first use."""
+        key = normalize_filters(filters)
+        with self._lock:
+            plan = self._plans.get(key)
+            rows = self.stats.rows
+            if plan is not None and plan.compiled_rows * RECOMPILE_FACTOR >= rows >= plan.compiled_rows / RECOMPILE_FACTOR:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+            self.misses += 1
+            plan = self.compile(dict(key))
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            if len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+            return plan
+
+    def compile(self, filters: dict) -> QueryPlan:
+        """Order the predicates by estimated selectivity and pick lookup or scan for each."""
+        stats = self.stats
+        rows = stats.rows
+        plain, geo_query = geo.split_filters(filters)
+        steps = []
+        if geo_query is not None and geo_query.inside is not None:
+            estimate = sum(stats.count_equal("place_id", place) for place in geo_query.inside)
+            steps.append(PlanStep("place_id", [], "scan", estimate, geo_query))
+        # min_ and max_ on one field become a single range step
+        ranges: Dict[str, PlanStep] = {}
+        for key, value in plain.items():
+            if value is None:
+                continue
+            range_key = parse_range_key(key)
+            if range_key is not None:
+                step = ranges.get(range_key[0])
+                if step is None:
+                    step = ranges[range_key[0]] = PlanStep(range_key[0], [], "range", 0)
+                    steps.append(step)
+                step.predicates.append((key, value))
+                continue
+            # Equality on a numeric field is a one-value range lookup
+            access = "bitmap" if key in BITMAP_FIELDS else "range" if key in RANGE_FIELDS else "scan"
+            steps.append(PlanStep(key, [(key, value)], access, stats.count_equal(key, value)))
+        for step in ranges.values():
+            step.estimate = stats.count_between(step.field, *step.bounds())
+        steps.sort(key=lambda step: step.estimate)
+
+        # Walk the steps most selective first; an index lookup is only worth
+        # it while it is cheaper than checking the rows still left
+        lookups, scans = [], []
+        remaining = float(rows)
+        for step in steps:
+            if step.access == "bitmap":
+                lookup_cost = rows * BITMAP_ROW_COST
+            elif step.access == "range":
+                lookup_cost = step.estimate * RANGE_ROW_COST
+            else:
+                lookup_cost = None
+            if lookup_cost is not None and (not lookups or lookup_cost < remaining * SCAN_COST):
+                lookups.append(step)
+            else:
+                step.access = "scan"
+                scans.append(step)
+            remaining *= step.estimate / rows if rows else 0
+        return QueryPlan(filters, lookups, scans, rows)
+
+    def stats_summary(self) -> dict:
+        return {"rows": self.stats.rows, "plans": len(self._plans), "hits": self.hits, "misses": self.misses}
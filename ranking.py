@@ -0,0 +1,112 @@
+import heapq
+from enum import Enum
+from typing import List, Optional
+
+import geo
+from lease import parse_lease
+from listing_index import parse_range_key, predicate_matches
+
+# Fields used to break ties between listings with the same fitness score
+SORT_ORDER = [
+    "cst", "location", "rooms", "length", "ppl",
+    "laundry", "parking", "gender", "floor", "pets"
+]
+
+
+def lease_length_comparator(length: Optional[str]) -> int:
+    """Convert lease length to an integer representing the lease duration for sorting."""
+    # 0 for no length, or one that names no duration or dates
+    return parse_lease(length).months or 0
+
+
+def lease_months(listing) -> int:
+    """Lease duration for sorting, parsed when the listing was loaded."""
+    lease = getattr(listing, "lease", None)
+    if lease is None:
+        return lease_length_comparator(getattr(listing, "length", None))
+    return lease.months or 0
+
+
+def safe_getattr(obj, attr, default=None):
+    """Safely get an attribute, returning a default if it doesn't exist or is None."""
+    return getattr(obj, attr, default) if obj else default
+
+
+def sort_order_for(filters: dict) -> List[str]:
+    """Fields named in the filters come first, in filter order."""
+    # Range filters such as max_cst give priority to the field they constrain
+    filter_fields = []
+    for key in filters:
+        range_key = parse_range_key(key)
+        field = range_key[0] if range_key else key
+        if field in SORT_ORDER and field not in filter_fields:
+            filter_fields.append(field)
+    return filter_fields + [key for key in SORT_ORDER if key not in filter_fields]
+
+
+def make_sort_key(filters: dict):
+    """Build the sort key used by rank_and_sort_all_features for these filters.
+
+    Listings matching more filters come first. Ties are broken by the fields
+    in sort_order_for(filters), each putting the lowest cost or the largest
+    value first and listings without a value last.
+
+    With a "near" filter the distance to it, a table lookup per listing,
+    follows the fitness score; "within_km" counts as one more predicate.
+    """
+    filters, geo_query = geo.split_filters(filters)
+    sort_order = sort_order_for(filters)
+    within = geo_query is not None and geo_query.within_km is not None
+
+    def calculate_fitness_score(user) -> int:
+        score = sum(1 for key, value in filters.items() if value is not None and predicate_matches(user, key, value))
+        if within and geo_query.matches(user):
+            score += 1
+        return score
+
+    def sort_key(user):
+        fitness_score = calculate_fitness_score(user)
+        key = [fitness_score]  # Sorted in reverse, so higher fitness comes first
+        if geo_query is not None:
+            # Closer first; listings that can't be placed go last
+            distance = geo_query.distance(user)
+            key.append((0, 0) if distance is None else (1, -distance))
+        for field in sort_order:
+            if field == "length":
+                attribute = lease_months(user)
+            else:
+                attribute = safe_getattr(user, field)
+            # Sorted in reverse: larger values first and None last, except
+            # cost, negated so the cheapest comes first. The rank keeps
+            # strings and numbers from ever being compared with each other
+            if attribute is None:
+                key.append((0, 0))
+            elif field == "cst":
+                key.append((1, -attribute))
+            else:
+                key.append((1, attribute.value if isinstance(attribute, Enum) else attribute))
+        return tuple(key)
+
+    return sort_key
+
+
+def rank_and_sort_all_features(
+    user_data_list: List,
+    filters: Optional[dict] = None,
+    limit: Optional[int] = None,
+    offset: int = 0
+) -> List:
+    """Rank and sort listings based on filters and sort order.
+
+    With a limit only the first offset + limit listings are selected, using a
+    heap instead of sorting everything. Any page is identical to the same
+    slice of the full sort.
+    """
+    if not filters:
+        filters = {}
+    sort_key = make_sort_key(filters)
+
+    if limit is None:
+        return sorted(user_data_list, key=sort_key, reverse=True)[offset:]
+    # nlargest(n) is documented to equal sorted(reverse=True)[:n], ties included
+    return heapq.nlargest(offset + limit, user_data_list, key=sort_key)[offset:]
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from listing_index import plain_value
+
+
+def normalize_filters(filters: Optional[dict]) -> Tuple:
+    """Canonical, hashable form of a filter dict.
+
+    Keys whose value is None do not filter anything, so {"pets": None} and {}
+    give the same key, and key order does not matter.
+    """
+    if not filters:
+        return ()
+    return tuple(sorted((key, plain_value(value)) for key, value in filters.items() if value is not None))
+
+
+class ResultCache:
+    """Bounded LRU cache of serialized responses.
+
+    Entries expire after ttl seconds and every entry is dropped as soon as a
+    lookup or insert comes with a newer write generation of the listings
+    (ListingStore.generation).
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Entries removed for space or age
+        self.invalidations = 0  # Times the cache was cleared by a new generation
+        self._generation = None
+        self._entries: "OrderedDict[Hashable, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+            self._generation = generation
+
+    def get(self, key: Hashable, generation) -> Optional[bytes]:
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if self.ttl is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, generation, value: bytes):
+        with self._lock:
+            self._check_generation(generation)
+            expires = time.monotonic() + self.ttl if self.ttl is not None else 0.0
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
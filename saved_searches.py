@@ -0,0 +1,266 @@
+"""Saved searches, matched against each new listing as it is appended.
+
+Instead of re-running every saved search when a post arrives, the searches
+are indexed by one of their predicates (a "percolator"): an equality such as
+floor == "top" is looked up by the listing's own value, and a range such as
+max_cst <= 1500 by bisecting the sorted bounds. Only those candidates, plus
+the few searches without any indexable predicate, are checked in full.
+"""
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import geo
+import metrics
+from listing import Listing
+from listing_index import RANGE_FIELDS, field_value, parse_range_key, plain_value
+from listing_log import listing_id
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; see post_writer.py
+    fcntl = None
+
+# Equality predicates tried as the index key first; the more distinct values
+# a field has, the fewer searches share a key
+ANCHOR_FIELDS = ("cst", "rooms", "ppl", "length", "gender", "floor", "location", "laundry", "parking", "pets")
+
+# Matches kept per user until they are read
+FEED_LIMIT = 100
+
+CANDIDATES = metrics.counter("saved_search_candidates_total", "Saved searches checked against new listings")
+MATCHES = metrics.counter("saved_search_matches_total", "New listings matching a saved search")
+
+
+class SavedSearch:
+    __slots__ = ("id", "user", "filters", "plain", "geo_query")
+
+    def __init__(self, id: int, user: str, filters: dict):
+        self.id = id
+        self.user = user
+        self.filters = {key: value for key, value in filters.items() if value is not None}
+        self.plain, self.geo_query = geo.split_filters(self.filters)
+
+    def matches(self, listing) -> bool:
+        return listing.matches_filter(self.plain) and (self.geo_query is None or self.geo_query.matches(listing))
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "user": self.user, "filters": self.filters}
+
+
+def anchor_for(filters: dict) -> Optional[tuple]:
+    """The predicate a search is indexed by: ("eq", field, value) or ("min"/"max", field, bound)."""
+    for field in ANCHOR_FIELDS:
+        if filters.get(field) is not None:
+            return ("eq", field, plain_value(filters[field]))
+    for key, value in filters.items():
+        range_key = parse_range_key(key)
+        if range_key is not None and value is not None:
+            field, bound = range_key
+            return (bound, field, value)
+    return None
+
+
+class PercolatorIndex:
+    """Saved searches indexed by one predicate each."""
+
+    def __init__(self):
+        self.searches: Dict[int, SavedSearch] = {}
+        self.equal: Dict[Tuple[str, Any], Set[int]] = {}
+        # (field, "min"/"max") -> sorted [(bound, search id)]
+        self.bounds: Dict[Tuple[str, str], List[Tuple[Any, int]]] = {}
+        self.unanchored: Set[int] = set()
+
+    def add(self, search: SavedSearch):
+        self.searches[search.id] = search
+        anchor = anchor_for(search.filters)
+        if anchor is None:
+            self.unanchored.add(search.id)
+        elif anchor[0] == "eq":
+            self.equal.setdefault(anchor[1:], set()).add(search.id)
+        else:
+            insort(self.bounds.setdefault((anchor[1], anchor[0]), []), (anchor[2], search.id))
+
+    def remove(self, search_id: int):
+        search = self.searches.pop(search_id, None)
+        if search is None:
+            return
+        anchor = anchor_for(search.filters)
+        if anchor is None:
+            self.unanchored.discard(search_id)
+        elif anchor[0] == "eq":
+            self.equal.get(anchor[1:], set()).discard(search_id)
+        else:
+            entries = self.bounds[(anchor[1], anchor[0])]
+            position = bisect_left(entries, (anchor[2], search_id))
+            if position < len(entries) and entries[position] == (anchor[2], search_id):
+                del entries[position]
+
+    def candidates(self, listing) -> Set[int]:
+        """Ids of the searches whose index predicate the listing satisfies."""
+        found = set(self.unanchored)
+        for field in ANCHOR_FIELDS:
+            found.update(self.equal.get((field, field_value(listing, field)), ()))
+        for field in RANGE_FIELDS:
+            value = getattr(listing, field, None)
+            if value is None:
+                continue
+            # min_x <= value: bounds up to value; max_x >= value: bounds from value
+            lows = self.bounds.get((field, "min"), [])
+            found.update(search_id for _, search_id in lows[:bisect_right(lows, (value, float("inf")))])
+            highs = self.bounds.get((field, "max"), [])
+            found.update(search_id for _, search_id in highs[bisect_left(highs, (value, -1)):])
+        return found
+
+    def match(self, listing) -> List[SavedSearch]:
+        candidates = self.candidates(listing)
+        CANDIDATES.inc(len(candidates))
+        return [self.searches[search_id] for search_id in sorted(candidates)
+                if self.searches[search_id].matches(listing)]
+
+
+class SavedSearches:
+    """Saved searches of all users, kept in a JSON file, and each user's feed of new matches.
+
+    Every worker process shares the files, so all reads and writes happen
+    under an flock and start from what is on disk:
+    - path holds the searches, as a JSON list.
+    - path + ".state" holds the next search id, the feeds, and how far the
+      listings have been matched: a segment of the CSV (see listing_log.py)
+      and a row in it.
+
+    match_new() matches the rows after that point and moves it on, so each
+    appended listing is matched once, by whichever process gets there first.
+    Register compacted() with listing_log.on_compact() so rows not matched yet
+    are matched before a compaction renumbers them.
+    """
+
+    def __init__(self, path: str, feed_limit: int = FEED_LIMIT):
+        self.path = path
+        self.feed_limit = feed_limit
+        self.index = PercolatorIndex()
+        self._indexed: Tuple[int, ...] = ()  # Ids of the searches in index
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[Tuple[List[dict], dict]]:
+        """The searches and state as on disk; changes made to them are written back if exclusive."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                searches = self._read(self.path, [])
+                state = self._read(self.path + ".state", {})
+                before = (json.dumps(searches), json.dumps(state, sort_keys=True))
+                yield searches, state
+                if exclusive:
+                    if json.dumps(searches) != before[0]:
+                        self._write(self.path, searches)
+                    if json.dumps(state, sort_keys=True) != before[1]:
+                        self._write(self.path + ".state", state)
+            finally:
+                # Closing the descriptor also releases the flock
+                os.close(fd)
+
+    @staticmethod
+    def _read(path: str, default):
+        try:
+            with open(path, encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return default
+
+    @staticmethod
+    def _write(path: str, value):
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding='utf-8') as file:
+            json.dump(value, file)
+        os.replace(temporary, path)
+
+    def save(self, user: str, filters: dict) -> SavedSearch:
+        with self._locked(exclusive=True) as (searches, state):
+            search_id = max([state.get("next_id", 1)] + [entry["id"] + 1 for entry in searches])
+            state["next_id"] = search_id + 1
+            search = SavedSearch(search_id, user, filters)
+            searches.append(search.to_dict())
+            return search
+
+    def delete(self, search_id: int) -> bool:
+        with self._locked(exclusive=True) as (searches, state):
+            kept = [entry for entry in searches if entry["id"] != search_id]
+            if len(kept) == len(searches):
+                return False
+            searches[:] = kept
+            return True
+
+    def for_user(self, user: str) -> List[SavedSearch]:
+        with self._locked(exclusive=False) as (searches, _):
+            return [SavedSearch(entry["id"], entry["user"], entry["filters"])
+                    for entry in searches if entry["user"] == user]
+
+    def _current_index(self, searches: List[dict]) -> PercolatorIndex:
+        # Searches only come and go by id, so the ids tell whether index is current
+        ids = tuple(entry["id"] for entry in searches)
+        if ids != self._indexed:
+            self.index = PercolatorIndex()
+            for entry in searches:
+                self.index.add(SavedSearch(entry["id"], entry["user"], entry["filters"]))
+            self._indexed = ids
+        return self.index
+
+    def _match(self, searches: List[dict], state: dict, segment: int, rows: Iterable[Tuple[int, Any]]):
+        index = self._current_index(searches)
+        feeds = state.setdefault("feeds", {})
+        for row_id, listing in rows:
+            for search in index.match(listing):
+                MATCHES.inc()
+                feed = feeds.setdefault(search.user, [])
+                feed.append({"search_id": search.id, "id": listing_id(segment, row_id), "listing": listing.to_dict()})
+                del feed[:-self.feed_limit]
+
+    def match_new(self, store):
+        """Match the listings appended to the store's CSV since any process last did.
+
+        The first call for a CSV only records where it ends: searches are
+        matched against later posts.
+        """
+        listings = store.get()
+        segment, deleted, rows = store.segment, store.deleted, len(listings)
+        if segment is None:
+            return
+        with self._locked(exclusive=True) as (searches, state):
+            matched = state.get("segment")
+            if matched is not None and matched > segment:
+                return  # This store hasn't read the compacted file yet
+            if matched is None or matched < segment:
+                # A compaction this process wasn't told about, e.g. one run from
+                # the command line: its unmatched rows can't be told apart
+                state["segment"], state["matched_rows"] = segment, rows
+                return
+            start = state["matched_rows"]
+            self._match(searches, state, segment,
+                        ((row_id, listings[row_id]) for row_id in range(start, rows) if row_id not in deleted))
+            state["matched_rows"] = max(start, rows)
+
+    def compacted(self, segment: int, new_segment: int, kept: List[Tuple[int, dict]]):
+        """listing_log.on_compact hook: match the kept rows not matched yet, then follow them to new_segment."""
+        with self._locked(exclusive=True) as (searches, state):
+            if state.get("segment") == segment:
+                start = state["matched_rows"]
+                # Matched under their ids in the new segment, which clients can still use
+                self._match(searches, state, new_segment,
+                            ((position, Listing.from_row(row)) for position, (row_id, row) in enumerate(kept)
+                             if row_id >= start))
+            state["segment"], state["matched_rows"] = new_segment, len(kept)
+
+    def take_feed(self, user: str) -> List[dict]:
+        """New matches for a user since the last call, oldest first."""
+        with self._locked(exclusive=True) as (_, state):
+            return state.get("feeds", {}).pop(user, [])
@@ -0,0 +1,316 @@
+"""Binary columnar snapshot of user_data.csv.
+
+The CSV stays the ingest format; compile_snapshot() turns it into a file that
+can be mmap'ed and used without parsing:
+
+    magic (8 bytes) | header length (uint64) | JSON header | column data
+
+Every column starts on an 8-byte boundary. Numbers and booleans are float64
+with NaN for None, strings and floors are int32 codes into a sorted
+dictionary kept in the header (-1 for None), and descr is a pair of int64
+start/length arrays (length -1 for None) over one UTF-8 blob. Lease length
+in months and the geo place id (int16, -1 for none) are stored precomputed,
+as are the parsed lease fields used by lease filters. Rows deleted through
+listing_log.py are left out, so snapshot rows are the live listings
+renumbered.
+
+Usage: python snapshot.py user_data.csv [user_data.csv.snap]
+"""
+import csv
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from typing import Dict, List, Optional, Set
+
+from listing import LISTING_FIELDS, FloorPreference, Listing
+import geo
+import listing_log
+from ranking import lease_months
+
+try:
+    import numpy as np
+except ImportError:  # Columns are still available as memoryviews
+    np = None
+
+MAGIC = b"NWSNAP04"
+
+# How each Listing field is stored
+FIELD_TYPES = {
+    "cst": "int",
+    "location": "bool",
+    "descr": "text",
+    "rooms": "int",
+    "ppl": "int",
+    "length": "str",
+    "laundry": "bool",
+    "parking": "bool",
+    "gender": "str",
+    "floor": "floor",
+    "pets": "bool",
+}
+
+
+def snapshot_path(csv_filename: str) -> str:
+    return csv_filename + ".snap"
+
+
+def _source_signature(csv_filename: str) -> Optional[Dict[str, int]]:
+    try:
+        stat = os.stat(csv_filename)
+    except FileNotFoundError:
+        return None
+    signature = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "inode": stat.st_ino}
+    try:
+        tombstones = os.stat(listing_log.tombstone_path(csv_filename))
+    except FileNotFoundError:
+        return signature
+    return dict(signature, tombstones_mtime_ns=tombstones.st_mtime_ns, tombstones_size=tombstones.st_size)
+
+
+def _pad(data: bytearray):
+    data.extend(b"\0" * (-len(data) % 8))
+
+
+def compile_snapshot(csv_filename: str, output: Optional[str] = None) -> str:
+    """Parse the CSV once and write its snapshot; returns the snapshot path."""
+    output = output or snapshot_path(csv_filename)
+    listings = []
+    # Compaction can't replace the CSV between reading its tombstones and its rows
+    with listing_log.current_segment(csv_filename) as tombstones:
+        source = _source_signature(csv_filename)
+        if tombstones is not None:
+            deleted = set(tombstones.rows())
+            with open(csv_filename, newline='', encoding='utf-8') as file:
+                listings = [Listing.from_row(row) for row_id, row in enumerate(csv.DictReader(file))
+                            if row_id not in deleted and any(row.values())]
+
+    blocks = []  # (column name, header entry, bytes)
+    for field in LISTING_FIELDS:
+        kind = FIELD_TYPES[field]
+        values = [getattr(listing, field) for listing in listings]
+        if kind in ("int", "bool"):
+            data = array("d", (math.nan if value is None else float(value) for value in values))
+            blocks.append((field, {"type": kind, "dtype": "d"}, data.tobytes()))
+        elif kind in ("str", "floor"):
+            if kind == "floor":
+                values = [value.value if value is not None else None for value in values]
+            categories = sorted({value for value in values if value is not None})
+            codes = {value: code for code, value in enumerate(categories)}
+            data = array("i", (-1 if value is None else codes[value] for value in values))
+            blocks.append((field, {"type": kind, "dtype": "i", "categories": categories}, data.tobytes()))
+        else:
+            blob = bytearray()
+            starts = array("q")
+            lengths = array("q")
+            for value in values:
+                starts.append(len(blob))
+                if value is None:
+                    lengths.append(-1)
+                else:
+                    encoded = value.encode("utf-8")
+                    lengths.append(len(encoded))
+                    blob.extend(encoded)
+            blocks.append((field + ".start", {"type": "offsets", "dtype": "q"}, starts.tobytes()))
+            blocks.append((field + ".length", {"type": "offsets", "dtype": "q"}, lengths.tobytes()))
+            blocks.append((field, {"type": kind, "dtype": "B"}, bytes(blob)))
+    months = array("d", (lease_months(listing) for listing in listings))
+    blocks.append(("length_months", {"type": "derived", "dtype": "d"}, months.tobytes()))
+    places = array("h", (-1 if (place := geo.place_id(listing)) is None else place for listing in listings))
+    blocks.append(("place_id", {"type": "derived", "dtype": "h"}, places.tobytes()))
+    lease = array("d", (math.nan if listing.lease_months is None else float(listing.lease_months)
+                        for listing in listings))
+    blocks.append(("lease_months", {"type": "derived", "dtype": "d"}, lease.tobytes()))
+    for field in ("lease_start", "lease_end"):
+        values = [getattr(listing, field) for listing in listings]
+        categories = sorted({value for value in values if value is not None})
+        codes = {value: code for code, value in enumerate(categories)}
+        data = array("i", (-1 if value is None else codes[value] for value in values))
+        blocks.append((field, {"type": "derived", "dtype": "i", "categories": categories}, data.tobytes()))
+
+    # Lay the columns out after the header; the header size depends on the
+    # offsets, so place them relative to the data region first
+    columns = {}
+    data = bytearray()
+    for name, entry, payload in blocks:
+        entry = dict(entry, offset=len(data), nbytes=len(payload))
+        columns[name] = entry
+        data.extend(payload)
+        _pad(data)
+    header = json.dumps({"rows": len(listings), "source": source, "columns": columns}).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    # A temporary file of our own: several processes may recompile the same
+    # snapshot at once, and each replaces it with a complete file
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output)),
+                                     prefix=os.path.basename(output) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(MAGIC)
+            file.write(struct.pack("<Q", len(header)))
+            file.write(header)
+            file.write(data)
+        os.chmod(temporary, 0o644)
+        # Readers that still have the old snapshot mapped keep seeing it
+        os.replace(temporary, output)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return output
+
+
+class Snapshot:
+    """A read-only mmap of a snapshot file.
+
+    Columns are exposed without copying, as memoryviews or NumPy arrays.
+    Indexing materializes one Listing, so the snapshot can stand in for the
+    list of listings the rest of the code expects.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a listing snapshot")
+        (header_length,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(bytes(self._mmap[header_start:header_start + header_length]))
+        self._data_start = header_start + header_length
+        self.rows: int = header["rows"]
+        self.source: Optional[Dict[str, int]] = header["source"]
+        self.columns: Dict[str, dict] = header["columns"]
+        self._views: Dict[str, memoryview] = {}
+        self._categories = {
+            name: [sys.intern(value) for value in entry["categories"]]
+            for name, entry in self.columns.items() if "categories" in entry
+        }
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def view(self, name: str) -> memoryview:
+        """Zero-copy memoryview of a column, typed by its struct format."""
+        view = self._views.get(name)
+        if view is None:
+            entry = self.columns[name]
+            start = self._data_start + entry["offset"]
+            view = memoryview(self._mmap)[start:start + entry["nbytes"]].cast(entry["dtype"])
+            self._views[name] = view
+        return view
+
+    def array(self, name: str):
+        """Zero-copy NumPy array of a column."""
+        if np is None:
+            raise RuntimeError("Snapshot.array() needs numpy installed")
+        return np.frombuffer(self.view(name), dtype=self.columns[name]["dtype"])
+
+    def categories(self, name: str) -> List[str]:
+        return self._categories[name]
+
+    def value(self, field: str, row: int):
+        kind = FIELD_TYPES[field]
+        if kind == "text":
+            length = self.view(field + ".length")[row]
+            if length < 0:
+                return None
+            start = self.view(field + ".start")[row]
+            return bytes(self.view(field)[start:start + length]).decode("utf-8")
+        raw = self.view(field)[row]
+        if kind in ("int", "bool"):
+            if math.isnan(raw):
+                return None
+            return int(raw) if kind == "int" else bool(raw)
+        if raw < 0:
+            return None
+        value = self._categories[field][raw]
+        return FloorPreference(value) if kind == "floor" else value
+
+    def __getitem__(self, row: int) -> Listing:
+        if row < 0:
+            row += self.rows
+        if not 0 <= row < self.rows:
+            raise IndexError("snapshot row out of range")
+        place = self.view("place_id")[row]
+        return Listing(*(self.value(field, row) for field in LISTING_FIELDS),
+                       place=geo.LOCATIONS[place] if 0 <= place < geo.CAMPUS_ID else None)
+
+    def __iter__(self):
+        for row in range(self.rows):
+            yield self[row]
+
+    def is_current(self, csv_filename: str) -> bool:
+        return self.source is not None and self.source == _source_signature(csv_filename)
+
+
+def load_snapshot(csv_filename: str) -> Snapshot:
+    """Open the snapshot of a CSV file, recompiling it first if the CSV changed.
+
+    Usable as a ListingStore loader: get_store(filename, load_snapshot).
+    """
+    path = snapshot_path(csv_filename)
+    if os.path.exists(path):
+        try:
+            snapshot = Snapshot(path)
+        except ValueError:  # Written in an older format
+            snapshot = None
+        if snapshot is not None and snapshot.is_current(csv_filename):
+            return snapshot
+    return Snapshot(compile_snapshot(csv_filename, path))
+
+
+# Snapshots opened by current_snapshot, and those being recompiled, by path
+_current: Dict[str, Snapshot] = {}
+_compiling: Set[str] = set()
+_current_lock = threading.Lock()
+
+
+def _recompile(csv_filename: str, path: str):
+    try:
+        compile_snapshot(csv_filename, path)
+    except Exception as e:
+        print(f"Compiling {path} failed: {e}")
+    finally:
+        with _current_lock:
+            _compiling.discard(path)
+
+
+def current_snapshot(csv_filename: str) -> Optional[Snapshot]:
+    """The snapshot of a CSV if it is up to date, else None.
+
+    Unlike load_snapshot this never compiles in the caller: an outdated
+    snapshot is recompiled by a background thread, and the caller ranks the
+    listings some other way until it is done.
+    """
+    path = snapshot_path(csv_filename)
+    with _current_lock:
+        snapshot = _current.get(path)
+        if snapshot is not None and snapshot.is_current(csv_filename):
+            return snapshot
+        if path in _compiling:
+            return None
+        try:
+            snapshot = Snapshot(path)
+        except (FileNotFoundError, ValueError):  # Not compiled yet, or in an older format
+            snapshot = None
+        if snapshot is not None and snapshot.is_current(csv_filename):
+            _current[path] = snapshot
+            return snapshot
+        if path not in _compiling:
+            _compiling.add(path)
+            threading.Thread(target=_recompile, args=(csv_filename, path),
+                             name="snapshot-compiler", daemon=True).start()
+        return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python snapshot.py user_data.csv [output.snap]")
+        sys.exit(1)
+    written = compile_snapshot(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"Wrote {len(Snapshot(written))} listings to {written}")
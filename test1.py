@@ -1,104 +1,114 @@
-from flask import Flask, request, jsonify, session
-from enum import Enum
-from typing import Optional, List
-import csv
+from flask import Flask, request, jsonify, session, g
+from datetime import date
+import base64
+import itertools
+import json
 import os
+import time
+
+import columnar
+import geo
+from bulk_import import number_reports, parse_post, read_records, validate_posts
+import duplicates
+import metrics
+from listing import LISTING_FIELDS, FloorPreference, Listing
+from listing_index import ListingIndex
+from listing_log import StaleSegmentError, get_compactor, listing_id, on_compact, open_tombstones, parse_listing_id
+from listing_store import CsvLoader, get_store
+from parallel_ranking import ShardedRanker
+from post_writer import get_writer
+from query_planner import QueryPlanner
+from ranking import rank_and_sort_all_features
+from result_cache import ResultCache, normalize_filters
+from saved_searches import SavedSearches
+from snapshot import current_snapshot
+from text_index import TextIndex
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key"  # For session handling
 
-# Enum for floor preference
-class FloorPreference(Enum):
-    BOTTOM = "bottom"
-    MIDDLE = "middle"
-    TOP = "top"
-
-# Data structure for user data
-class UserData:
-    def __init__(self, cst, location, descr, rooms, ppl, length, laundry, parking, gender, floor, pets):
-        self.cst = cst
-        self.location = location
-        self.descr = descr
-        self.rooms = rooms
-        self.ppl = ppl
-        self.length = length
-        self.laundry = laundry
-        self.parking = parking
-        self.gender = gender
-        self.floor = floor
-        self.pets = pets
-
-    def to_dict(self):
-        return {
-            "cst": self.cst,
-            "location": self.location,
-            "descr": self.descr,
-            "rooms": self.rooms,
-            "ppl": self.ppl,
-            "length": self.length,
-            "laundry": self.laundry,
-            "parking": self.parking,
-            "gender": self.gender,
-            "floor": self.floor.value if self.floor else None,
-            "pets": self.pets
-        }
-
-    def matches_filter(self, filters):
-        for key, value in filters.items():
-            if value is not None and getattr(self, key, None) != value:
-                return False
-        return True
-
-def match_filter(filter1, filter2):
-    for key, value in filter2.items():
-        print("key")
-        print(key)
-        if value is not None and filter1[key] != value:
-            return False
-    return True
-
-# Read user data from the CSV file
-def read_user_data(filename: str) -> List[UserData]:
-    user_data_list = []
-    if not os.path.exists(filename):
-        return user_data_list
-    with open(filename, mode='r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            
-            user_data_list.append(UserData(
-                cst=int(row['cst']) if row['cst'] else None,
-                location=row['location'].lower() == 'true' if row['location'] else None,
-                descr=row.get('descr'),
-                rooms=int(row['rooms']) if row['rooms'] else None,
-                ppl=int(row['ppl']) if row['ppl'] else None,
-                length=row.get('length'),
-                laundry=row['laundry'].lower() == 'true' if row['laundry'] else None,
-                parking=row['parking'].lower() == 'true' if row['parking'] else None,
-                gender=row.get('gender'),
-                floor=FloorPreference[row['floor'].upper()] if (row.get('floor') and row['floor'].upper() in FloorPreference.__members__)    else None,
-                pets=row['pets'].lower() == 'true' if row['pets'] else None
-            ))
-    return user_data_list
+# Serialized /listings responses, keyed by the normalized session filters
+listings_cache = ResultCache(max_entries=256, ttl=300)
+
+# Saved searches, matched against new posts before a feed is read; shared by
+# every worker through files next to the CSV
+saved_searches = SavedSearches('nwhack25/saved_searches.json')
+on_compact('nwhack25/user_data.csv', saved_searches.compacted)
+
+# Worker processes for /listings/ranked on large listing sets; 0 or 1 ranks in the request thread
+RANK_WORKERS = int(os.environ.get('RANK_WORKERS', '0'))
+sharded_ranker = ShardedRanker(RANK_WORKERS) if RANK_WORKERS > 1 else None
+
+# Seconds between checks for enough deleted rows to compact user_data.csv
+COMPACT_INTERVAL = float(os.environ.get('COMPACT_INTERVAL', '300'))
+
+# What posts that look like re-posts of a listing get: flag, merge or off;
+# ?duplicates= overrides it per request
+DUPLICATE_MODE = os.environ.get('DUPLICATE_MODE', duplicates.FLAG)
+
+metrics.gauge("listings_cache_hits", "Result cache hits", lambda: listings_cache.hits)
+metrics.gauge("listings_cache_misses", "Result cache misses", lambda: listings_cache.misses)
+metrics.gauge("listings_cache_evictions", "Result cache entries evicted for space or age", lambda: listings_cache.evictions)
+
+@app.before_request
+def start_request_timer():
+    if metrics.ENABLED:
+        g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    if metrics.ENABLED and 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start,
+                                        route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return app.response_class(metrics.render(), status=200, mimetype='text/plain; version=0.0.4')
+
+# Read user data from the CSV file; the store also uses it to read only
+# the rows appended since its last read
+read_user_data = CsvLoader(Listing.from_row)
+
+def parse_filters(filters):
+    """Validate the filters posted by a client."""
+    # A radius means nothing without its centre, and would otherwise be dropped silently
+    if filters.get('within_km') and not filters.get('near'):
+        raise ValueError("within_km needs near")
+    return {
+        'cst': int(filters['cst']) if 'cst' in filters and filters['cst'] else None,
+        'max_cst': int(filters['max_cst']) if 'max_cst' in filters and filters['max_cst'] else None,
+        'location': filters['location'].lower() == 'true' if 'location' in filters else None,
+        'rooms': int(filters['rooms']) if 'rooms' in filters and filters['rooms'] else None,
+        'min_rooms': int(filters['min_rooms']) if 'min_rooms' in filters and filters['min_rooms'] else None,
+        'ppl': int(filters['ppl']) if 'ppl' in filters and filters['ppl'] else None,
+        'min_ppl': int(filters['min_ppl']) if 'min_ppl' in filters and filters['min_ppl'] else None,
+        'max_ppl': int(filters['max_ppl']) if 'max_ppl' in filters and filters['max_ppl'] else None,
+        'length': filters.get('length'),
+        'laundry': filters['laundry'].lower() == 'true' if 'laundry' in filters else None,
+        'parking': filters['parking'].lower() == 'true' if 'parking' in filters else None,
+        'gender': filters.get('gender'),
+        'floor': filters['floor'].lower() if 'floor' in filters and filters['floor'].upper() in FloorPreference.__members__ else None,
+        'pets': filters['pets'].lower() == 'true' if 'pets' in filters else None,
+        'near': filters['near'] if 'near' in filters and geo.resolve_point(filters['near']) else None,
+        'within_km': float(filters['within_km']) if 'within_km' in filters and filters['within_km'] else None,
+        'min_lease_months': int(filters['min_lease_months']) if filters.get('min_lease_months') else None,
+        # Available at some point between available_from and available_to (ISO dates):
+        # the lease starts by the end of that window and ends after its start
+        'max_lease_start': date.fromisoformat(filters['available_to']).isoformat() if filters.get('available_to') else None,
+        'min_lease_end': date.fromisoformat(filters['available_from']).isoformat() if filters.get('available_from') else None
+    }
 
 @app.route('/filters', methods=['POST'])
 def set_filters():
-    try:
-        filters = request.get_json()
+    filename = 'nwhack25/user_data.csv'
 
+    try:
         # Validate and store filters in session
-        session['filters'] = {
-            'cst': int(filters['cst']) if 'cst' in filters and filters['cst'] else None,
-            'location': filters['location'].lower() == 'true' if 'location' in filters else None,
-            'rooms': int(filters['rooms']) if 'rooms' in filters and filters['rooms'] else None,
-            'ppl': int(filters['ppl']) if 'ppl' in filters and filters['ppl'] else None,
-            'length': filters.get('length'),
-            'laundry': filters['laundry'].lower() == 'true' if 'laundry' in filters else None,
-            'parking': filters['parking'].lower() == 'true' if 'parking' in filters else None,
-            'gender': filters.get('gender'),
-            'floor': filters['floor'].lower() if 'floor' in filters and filters['floor'].upper() in FloorPreference.__members__ else None,
-            'pets': filters['pets'].lower() == 'true' if 'pets' in filters else None
-        }
+        session['filters'] = parse_filters(request.get_json())
+        # Compile the query plan now so /listings finds it in the plan cache
+        get_store(filename, read_user_data).derived("planner", QueryPlanner).plan(session['filters'])
         return jsonify({"message": "Filters set successfully!"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -111,55 +121,354 @@ def get_listings():
         # Retrieve filters from session
         filters = session['filters']
 
-        print("filter values")
-        print(filters)
-
         if not filters:
             return jsonify({"message": "No filters set. Use POST /filters to set filters."}), 400
 
-        # Read data from CSV and apply filters
-        user_data_list = read_user_data(filename)
-        filtered_data = [user.to_dict() for user in user_data_list if match_filter(user.to_dict(), filters)]
+        # Filter through the bitmap index kept alongside the in-memory listings,
+        # following the plan compiled for these filters
+        store = get_store(filename, read_user_data)
+        index = store.derived("bitmap", ListingIndex)
+        plan = store.derived("planner", QueryPlanner).plan(filters)
+
+        if request.args.get('explain'):
+            return jsonify(plan.explain(index)), 200
+        if request.args.get('format') == 'ndjson':
+            return stream_listings(store, index, plan)
+
+        # Same filters and no new posts since: reuse the serialized response
+        cache_key = ("listings", normalize_filters(filters))
+        cached = listings_cache.get(cache_key, store.generation)
+        if cached is not None:
+            return app.response_class(cached, status=200, mimetype='application/json')
+
+        generation = store.generation
+        with metrics.STAGE_SECONDS.time(stage="filter"):
+            user_data_list = index.listings
+            rows = plan.execute(index)
+        metrics.ROWS_MATCHED.inc(len(rows))
+        with metrics.STAGE_SECONDS.time(stage="serialize"):
+            response = jsonify([dict(user_data_list[row_id].to_dict(), id=listing_id(store.segment, row_id))
+                                for row_id in rows])
+        listings_cache.put(cache_key, generation, response.get_data())
+        return response, 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Continuation tokens name the next row to send, as a listing id. Appends
+# never move rows, but a compaction renumbers them, so tokens from another
+# segment are rejected. Every worker reads the segment from the tombstone
+# file, so a token is good on any of them.
+def encode_cursor(segment: int, row_id: int) -> str:
+    return base64.urlsafe_b64encode(listing_id(segment, row_id).encode()).decode()
+
+def decode_cursor(token: str):
+    return parse_listing_id(base64.urlsafe_b64decode(token.encode()).decode())
+
+def stream_listings(store, index, plan):
+    """One page of matching listings as NDJSON, serialized while it is sent.
 
+    Only the row ids of the page are held in memory; the token for the next
+    page is returned in the X-Next-Cursor header.
+    """
+    try:
+        # An empty page would hand back a cursor to the same row forever
+        page_size = max(1, min(int(request.args.get('page_size', 500)), 10000))
+    except ValueError:
+        return jsonify({"error": "page_size must be an integer"}), 400
+    user_data_list = store.listings
+    segment = store.segment
+    start = 0
+    if request.args.get('cursor'):
+        try:
+            cursor_segment, start = decode_cursor(request.args['cursor'])
+        except ValueError:  # Also bad base64 and non-UTF-8 bytes
+            cursor_segment, start = None, -1
+        if start < 0:
+            return jsonify({"error": "Invalid cursor"}), 400
+        if cursor_segment != segment:
+            return jsonify({"error": "Cursor has expired, the listings were compacted"}), 410
+
+    rows = plan.iter_rows(index, start)
+    page = list(itertools.islice(rows, page_size))
+    next_row = next(rows, None)
+    headers = {}
+    if next_row is not None:
+        headers['X-Next-Cursor'] = encode_cursor(segment, next_row)
+
+    def generate():
+        for row_id in page:
+            yield json.dumps(dict(user_data_list[row_id].to_dict(), id=listing_id(segment, row_id))) + "\n"
+
+    return app.response_class(generate(), status=200, mimetype='application/x-ndjson', headers=headers)
+
+@app.route('/listings/ranked', methods=['GET'])
+def get_ranked_listings():
+    filename = 'nwhack25/user_data.csv'
 
-        return jsonify(filtered_data), 200
+    try:
+        # All listings, most fitting first; only the requested page is selected
+        filters = session.get('filters') or {}
+        limit = int(request.args.get('limit', 20))
+        offset = int(request.args.get('offset', 0))
+        if limit < 1 or offset < 0:
+            return jsonify({"error": "limit must be positive and offset non-negative"}), 400
+
+        store = get_store(filename, read_user_data)
+        if columnar.available():
+            # Same order as the Python ranking, computed on NumPy columns kept
+            # in step with the in-memory listings as posts come in
+            columns = store.derived("columns", columnar.ListingColumns)
+            live_rows = len(store.listings) - len(store.deleted)
+            # The pool's workers map the binary snapshot of the CSV, which is
+            # recompiled in the background after a post; until then rank here
+            snapshot = None
+            if sharded_ranker is not None and live_rows >= 2 * sharded_ranker.min_shard_rows:
+                snapshot = current_snapshot(filename)
+            with metrics.STAGE_SECONDS.time(stage="rank"):
+                if snapshot is not None:
+                    page = sharded_ranker.rank(snapshot, filters, limit=limit, offset=offset)
+                else:
+                    page = columns.rank(filters, limit=limit, offset=offset)
+        else:
+            user_data_list = store.live()
+            live_rows = len(user_data_list)
+            with metrics.STAGE_SECONDS.time(stage="rank"):
+                page = rank_and_sort_all_features(user_data_list, filters, limit=limit, offset=offset)
+        next_offset = offset + limit if offset + limit < live_rows else None
+
+        with metrics.STAGE_SECONDS.time(stage="serialize"):
+            response = jsonify({
+                "listings": [user.to_dict() for user in page],
+                "offset": offset,
+                "limit": limit,
+                "next_offset": next_offset
+            })
+        return response, 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/search', methods=['GET'])
+def search_listings():
+    filename = 'nwhack25/user_data.csv'
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing search query. Use /search?q=..."}), 400
+
+    try:
+        limit = int(request.args.get('limit', 20))
+        store = get_store(filename, read_user_data)
+        text_index = store.derived("text", TextIndex)
+
+        # Restrict to listings matching the structured filters, if any are set
+        filters = session.get('filters')
+        rows = None
+        if filters and any(value is not None for value in filters.values()):
+            index = store.derived("bitmap", ListingIndex)
+            rows = set(store.derived("planner", QueryPlanner).plan(filters).execute(index))
+
+        with metrics.STAGE_SECONDS.time(stage="search"):
+            hits = text_index.search(query, rows=rows, limit=limit)
+        user_data_list = store.listings
+        results = [dict(user_data_list[row_id].to_dict(), id=listing_id(store.segment, row_id), score=round(score, 4))
+                   for row_id, score in hits]
+        return jsonify(results), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/listings/cache', methods=['GET'])
+def get_listings_cache_stats():
+    return jsonify(listings_cache.stats()), 200
+
+def match_saved_searches(filename):
+    # Rows appended since any worker last matched, including by other processes
+    saved_searches.match_new(get_store(filename, read_user_data))
+
+@app.route('/saved_searches', methods=['POST'])
+def save_search():
+    data = request.get_json() or {}
+    user = data.get('user')
+    if not user:
+        return jsonify({"error": "user is required"}), 400
+    try:
+        # The posted filters, or else the ones set with POST /filters
+        filters = parse_filters(data['filters']) if 'filters' in data else session.get('filters')
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    if not filters or all(value is None for value in filters.values()):
+        return jsonify({"error": "No filters to save. Send filters or use POST /filters first."}), 400
+
+    # Listings posted from now on are matched against the new search
+    match_saved_searches('nwhack25/user_data.csv')
+    search = saved_searches.save(user, filters)
+    return jsonify(search.to_dict()), 201
+
+@app.route('/saved_searches', methods=['GET'])
+def list_saved_searches():
+    user = request.args.get('user')
+    if not user:
+        return jsonify({"error": "user is required"}), 400
+    return jsonify([search.to_dict() for search in saved_searches.for_user(user)]), 200
+
+@app.route('/saved_searches/<int:search_id>', methods=['DELETE'])
+def delete_saved_search(search_id):
+    if not saved_searches.delete(search_id):
+        return jsonify({"error": "No such saved search"}), 404
+    return jsonify({"message": "Saved search deleted"}), 200
+
+@app.route('/saved_searches/feed', methods=['GET'])
+def saved_search_feed():
+    user = request.args.get('user')
+    if not user:
+        return jsonify({"error": "user is required"}), 400
+    match_saved_searches('nwhack25/user_data.csv')
+    return jsonify({"matches": saved_searches.take_feed(user)}), 200
+
 @app.route('/add_post', methods=['POST'])
 def add_post():
     filename = 'nwhack25/user_data.csv'
 
     data = request.get_json()
+    mode = request.args.get('duplicates', DUPLICATE_MODE)
+    if mode not in duplicates.MODES:
+        return jsonify({"error": f"duplicates must be one of {', '.join(duplicates.MODES)}"}), 400
     try:
-        # Parse request JSON
-
         # Validate and construct new user data
-        new_user = {
-            "cst": int(data['cst']),
-            "location": data['location'].lower() == 'true',
-            "descr": data.get('descr', ''),
-            "rooms": int(data['rooms']) if 'rooms' in data else None,
-            "ppl": int(data['ppl']) if 'ppl' in data else None,
-            "length": data.get('length', ''),
-            "laundry": data['laundry'].lower() == 'true' if 'laundry' in data else None,
-            "parking": data['parking'].lower() == 'true' if 'parking' in data else None,
-            "gender": data.get('gender', ''),
-            "floor": data['floor'].upper() if 'floor' in data else None,
-            "pets": data['pets'].lower() == 'true' if 'pets' in data else None
-        }
-
-        # Append to CSV
-        file_exists = os.path.isfile(filename)
-        with open(filename, mode='a', newline='', encoding='utf-8') as file:
-            writer = csv.DictWriter(file, fieldnames=new_user.keys())
-            if not file_exists:
-                writer.writeheader()  # Write header if file is new
-            writer.writerow(new_user)
-
-        return jsonify({"message": "Post added successfully!"}), 201
+        new_user = parse_post(data)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+    try:
+        # Check for re-posts, then append to CSV through the shared writer;
+        # returns once the row is on disk and the store has picked it up
+        with metrics.STAGE_SECONDS.time(stage="post_commit"):
+            _, reports = duplicates.append_posts(get_store(filename, read_user_data), [new_user], mode)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    response = {"message": "Post added successfully!"}
+    if reports:
+        response.update(reports[0][1])
+    return jsonify(response), 201
+
+def listing_row(store, value):
+    """(segment, row id) of a live listing from an id given out by /listings.
+
+    Raises KeyError if there is no such listing and StaleSegmentError if the
+    id was given out before the file was compacted.
+    """
+    try:
+        segment, row_id = parse_listing_id(value)
+    except ValueError:
+        raise KeyError(value) from None
+    store.get()
+    if segment != store.segment:
+        raise StaleSegmentError("The listings were compacted since this id was given out")
+    if not 0 <= row_id < len(store.listings) or row_id in store.deleted:
+        raise KeyError(value)
+    return segment, row_id
+
+def appended_listing_id(store, segment, first_row, row):
+    """Id of the newest live listing equal to a posted row, looking from first_row of segment on.
+
+    A compaction since then renumbers the rows, so the whole file is searched.
+    """
+    store.get()
+    wanted = duplicates.listing_from_post(row).to_dict()
+    first_row = first_row if store.segment == segment else 0
+    for row_id in range(len(store.listings) - 1, first_row - 1, -1):
+        if row_id not in store.deleted and store.listings[row_id].to_dict() == wanted:
+            return listing_id(store.segment, row_id)
+    return None
+
+@app.route('/listings/<listing_id>', methods=['PUT'])
+def update_post(listing_id):
+    filename = 'nwhack25/user_data.csv'
+
+    try:
+        new_user = parse_post(request.get_json())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    store = get_store(filename, read_user_data)
+    try:
+        segment, row_id = listing_row(store, listing_id)
+        first_row = len(store.listings)
+        # Append the new version before deleting the old one; holding the
+        # tombstone file keeps compaction from moving rows in between
+        with open_tombstones(filename, segment) as tombstones:
+            if row_id in tombstones.rows():
+                raise KeyError(listing_id)
+            with metrics.STAGE_SECONDS.time(stage="post_commit"):
+                get_writer(filename, LISTING_FIELDS).submit(new_user)
+            tombstones.delete([row_id])
+        # The new version is a new row, so the listing has a new id
+        new_id = appended_listing_id(store, segment, first_row, new_user)
+        get_compactor(filename, interval=COMPACT_INTERVAL)
+    except KeyError:
+        return jsonify({"error": "No such listing"}), 404
+    except StaleSegmentError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({"message": "Post updated successfully!", "id": new_id}), 200
+
+@app.route('/listings/<listing_id>', methods=['DELETE'])
+def delete_post(listing_id):
+    filename = 'nwhack25/user_data.csv'
+
+    store = get_store(filename, read_user_data)
+    try:
+        segment, row_id = listing_row(store, listing_id)
+        with open_tombstones(filename, segment) as tombstones:
+            if row_id in tombstones.rows():
+                raise KeyError(listing_id)
+            tombstones.delete([row_id])
+        store.get()
+        get_compactor(filename, interval=COMPACT_INTERVAL)
+    except KeyError:
+        return jsonify({"error": "No such listing"}), 404
+    except StaleSegmentError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({"message": "Post deleted successfully!"}), 200
+
+@app.route('/add_posts', methods=['POST'])
+def add_posts():
+    filename = 'nwhack25/user_data.csv'
+
+    mode = request.args.get('duplicates', DUPLICATE_MODE)
+    if mode not in duplicates.MODES:
+        return jsonify({"error": f"duplicates must be one of {', '.join(duplicates.MODES)}"}), 400
+    # A JSON array, or NDJSON with one listing per line
+    try:
+        text = request.get_data(as_text=True)
+        fmt = "json" if request.is_json and text.lstrip().startswith("[") else "ndjson"
+        with metrics.STAGE_SECONDS.time(stage="bulk_validate"):
+            records = list(read_records(text, fmt))
+            rows, errors = validate_posts(records)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    if not rows:
+        return jsonify({"added": 0, "errors": [{"index": position, "error": message}
+                                               for position, message in errors]}), 400
+
+    try:
+        # One duplicate check, one append and one fsync for the whole batch,
+        # then one incremental index update when the store tails the new rows
+        with metrics.STAGE_SECONDS.time(stage="post_commit"):
+            added, reports = duplicates.append_posts(get_store(filename, read_user_data), rows, mode)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({
+        "added": added,
+        "errors": [{"index": position, "error": message} for position, message in errors],
+        "duplicates": number_reports(records, errors, reports)
+    }), 201
+
 if __name__ == '__main__':
     app.run(debug=True)
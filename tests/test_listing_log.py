@@ -0,0 +1,243 @@
+"""Deletes, updates and compaction of the listings CSV, and the processes sharing it.
+
+Other workers are run as spawned processes, so they share nothing with the
+test but the files.
+"""
+import csv
+import json
+import multiprocessing
+import os
+
+import pytest
+
+import listing_log
+from listing import LISTING_FIELDS, Listing
+from listing_store import CsvLoader, ListingStore
+from post_writer import get_writer
+from saved_searches import SavedSearches
+
+DESCRIPTIONS = [
+    "Sunny corner room with a view of the mountains",
+    "Basement suite close to the bus loop",
+    "Shared two bedroom flat above a bakery",
+    "Quiet studio next to the rose garden",
+]
+
+
+def row(position: int, **fields) -> dict:
+    values = {field: "" for field in LISTING_FIELDS}
+    values.update(cst=str(900 + 100 * position), location="Exchange", descr=DESCRIPTIONS[position % len(DESCRIPTIONS)],
+                  rooms=str(1 + position % 3), length="8 months")
+    values.update(fields)
+    return values
+
+
+def write_rows(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=LISTING_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_rows(path):
+    with open(path, newline="", encoding="utf-8") as file:
+        return list(csv.DictReader(file))
+
+
+def spawn(target, *args):
+    """Run target in a fresh interpreter, as another worker would, and wait for it."""
+    process = multiprocessing.get_context("spawn").Process(target=target, args=args)
+    process.start()
+    process.join(60)
+    assert process.exitcode == 0
+
+
+def append_and_delete(path, rows, deleted):
+    get_writer(path, LISTING_FIELDS).submit_many(rows)
+    listing_log.delete_rows(path, listing_log.read_segment(path), deleted)
+
+
+def compact(path):
+    listing_log.compact(path)
+
+
+def post(path, rows):
+    writer = get_writer(path, LISTING_FIELDS)
+    for values in rows:
+        writer.submit(values)
+
+
+def post_and_match(path, searches_path, rows):
+    get_writer(path, LISTING_FIELDS).submit_many(rows)
+    SavedSearches(searches_path).match_new(ListingStore(path, CsvLoader(Listing.from_row)))
+
+
+def post_and_compact(path, searches_path, rows, deleted):
+    listing_log.on_compact(path, SavedSearches(searches_path).compacted)
+    append_and_delete(path, rows, deleted)
+    listing_log.compact(path)
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = str(tmp_path / "user_data.csv")
+    write_rows(path, [row(position) for position in range(4)])
+    return path
+
+
+def test_compact_drops_deleted_rows_and_starts_a_segment(csv_path):
+    with listing_log.current_segment(csv_path) as tombstones:
+        segment = tombstones.segment
+    listing_log.delete_rows(csv_path, segment, [1, 2])
+
+    stats = listing_log.compact(csv_path)
+
+    assert (stats["rows"], stats["deleted"], stats["malformed"]) == (2, 2, 0)
+    assert [entry["descr"] for entry in read_rows(csv_path)] == [DESCRIPTIONS[0], DESCRIPTIONS[3]]
+    assert listing_log.read_segment(csv_path) == segment + 1
+    assert listing_log.read_tombstones(csv_path, segment + 1)[0] == []
+    with pytest.raises(listing_log.StaleSegmentError):
+        listing_log.delete_rows(csv_path, segment, [0])
+
+
+def test_crash_between_the_replaces_starts_a_new_segment(csv_path, monkeypatch):
+    with listing_log.current_segment(csv_path) as tombstones:
+        segment = tombstones.segment
+    listing_log.delete_rows(csv_path, segment, [0])
+
+    replace = os.replace
+
+    def replace_csv_only(source, destination):
+        if destination == listing_log.tombstone_path(csv_path):
+            raise OSError("crashed")
+        replace(source, destination)
+
+    monkeypatch.setattr(listing_log.os, "replace", replace_csv_only)
+    with pytest.raises(OSError):
+        listing_log.compact(csv_path)
+    monkeypatch.undo()
+
+    # The compacted CSV is in place, under a header naming the old file
+    assert len(read_rows(csv_path)) == 3
+    assert listing_log.read_segment(csv_path) is None
+    with open(listing_log.tombstone_path(csv_path), "rb") as file:
+        assert file.readline().split()[1] == str(segment).encode()
+
+    store = ListingStore(csv_path, CsvLoader(Listing.from_row))
+    store.get()
+    # Row 0 of the new file is not the row deleted from the old one
+    assert store.segment == segment + 1
+    assert len(store.listings) == 3 and store.deleted == set()
+    with open(listing_log.tombstone_path(csv_path), "rb") as file:
+        assert file.read().split() == [b"segment", str(segment + 1).encode(), str(os.stat(csv_path).st_ino).encode()]
+    with pytest.raises(listing_log.StaleSegmentError):
+        listing_log.delete_rows(csv_path, segment, [1])
+
+
+def test_store_tails_rows_appended_and_deleted_by_another_process(csv_path):
+    store = ListingStore(csv_path, CsvLoader(Listing.from_row))
+    store.get()
+    segment = store.segment
+
+    spawn(append_and_delete, csv_path, [row(4), row(5)], [1, 4])
+
+    listings = store.get()
+    assert (store.loads, store.appends) == (1, 1)
+    assert store.segment == segment
+    assert [listing.cst for listing in listings] == [900, 1000, 1100, 1200, 1300, 1400]
+    assert store.deleted == {1, 4}
+    assert [listing.cst for listing in store.live()] == [900, 1100, 1200, 1400]
+
+    spawn(compact, csv_path)
+
+    listings = store.get()
+    assert store.loads == 2
+    assert store.segment == segment + 1
+    assert [listing.cst for listing in listings] == [900, 1100, 1200, 1400]
+    assert store.deleted == set()
+
+
+def test_writers_in_several_processes_append_whole_rows(tmp_path):
+    path = str(tmp_path / "posts" / "user_data.csv")
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=post, args=(path, [row(writer * 25 + position) for position in range(25)]))
+                 for writer in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    with open(path, encoding="utf-8") as file:
+        assert file.read().count("cst,location") == 1
+    rows = read_rows(path)
+    assert all(listing_log.well_formed(values) for values in rows)
+    assert sorted(int(values["cst"]) for values in rows) == [900 + 100 * position for position in range(100)]
+
+
+def test_saved_searches_are_shared_by_processes(csv_path, tmp_path):
+    searches_path = str(tmp_path / "saved_searches.json")
+    searches = SavedSearches(searches_path)
+    store = ListingStore(csv_path, CsvLoader(Listing.from_row))
+    searches.match_new(store)  # Later posts are matched from here on
+    search = searches.save("ana", {"max_cst": 1000, "rooms": None})
+    segment = store.segment
+
+    spawn(post_and_match, csv_path, searches_path, [row(0, cst="800"), row(1, cst="1500")])
+
+    # Matched once, by the process that posted
+    feed = searches.take_feed("ana")
+    assert [(entry["search_id"], entry["id"]) for entry in feed] == [(search.id, listing_log.listing_id(segment, 4))]
+    searches.match_new(store)
+    assert searches.take_feed("ana") == []
+
+    spawn(post_and_compact, csv_path, searches_path, [row(2, cst="700")], [0, 1])
+
+    # The post wasn't matched before the compaction, so the hook matched it under its new id
+    feed = searches.take_feed("ana")
+    assert [entry["id"] for entry in feed] == [listing_log.listing_id(segment + 1, 4)]
+    assert feed[0]["listing"]["cst"] == 700
+    searches.match_new(store)
+    assert searches.take_feed("ana") == []
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # test1.py keeps its files under nwhack25/ in the working directory
+    monkeypatch.chdir(tmp_path)
+    write_rows("nwhack25/user_data.csv", [row(position) for position in range(3)])
+    import test1
+    client = test1.app.test_client()
+    assert client.post("/filters", json={}).status_code == 200
+    return client
+
+
+def listing_ids(client):
+    response = client.get("/listings?format=ndjson")
+    assert response.status_code == 200
+    return [json.loads(line)["id"] for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_delete_update_and_stale_ids(client):
+    first, second, third = listing_ids(client)
+
+    assert client.delete(f"/listings/{first}").status_code == 200
+    assert client.delete(f"/listings/{first}").status_code == 404
+    assert listing_ids(client) == [second, third]
+
+    response = client.put(f"/listings/{second}", json={"cst": 750, "location": "Exchange", "descr": "Updated"})
+    assert response.status_code == 200
+    updated = response.get_json()["id"]
+    assert listing_ids(client) == [third, updated]
+    assert client.put(f"/listings/{second}", json={"cst": 700, "location": "Exchange"}).status_code == 404
+
+    listing_log.compact("nwhack25/user_data.csv")
+
+    # Ids handed out before the compaction name rows that have moved
+    assert client.delete(f"/listings/{third}").status_code == 409
+    assert client.put(f"/listings/{updated}", json={"cst": 700, "location": "Exchange"}).status_code == 409
+    current = listing_ids(client)
+    assert len(current) == 2 and not set(current) & {third, updated}
+    assert client.delete(f"/listings/{current[1]}").status_code == 200
+    assert [entry["descr"] for entry in read_rows("nwhack25/user_data.csv")] == [DESCRIPTIONS[2], "Updated"]
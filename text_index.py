@@ -0,0 +1,106 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Collection, Dict, List, Optional, Tuple
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Words too common in listings to help ranking
+STOPWORDS = frozenset({
+    "a", "an", "and", "are", "at", "for", "from", "in", "is", "it", "of",
+    "on", "or", "the", "to", "very", "with",
+})
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase, strip accents, split on non-alphanumerics and drop stopwords.
+
+    A trailing plural "s" is removed so "views" matches "view".
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    tokens = []
+    for token in _TOKEN.findall(text):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class TextIndex:
+    """Inverted index over one text field with BM25 scoring.
+
+    A query only walks the posting lists of its terms, so its cost follows
+    how many listings contain those terms, not how many listings there are.
+    """
+
+    def __init__(self, listings: List, field: str = "descr", k1: float = 1.5, b: float = 0.75):
+        self.field = field
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}  # term -> [(row id, term frequency)]
+        self.lengths: List[int] = []  # Tokens per row
+        self.total_length = 0
+        self.documents = 0  # Rows indexed and not removed
+        for row_id, listing in enumerate(listings):
+            self.add(row_id, listing)
+
+    def add(self, row_id: int, listing):
+        """Index one listing; row ids must be added in increasing order."""
+        tokens = tokenize(getattr(listing, self.field, None))
+        while len(self.lengths) < row_id:
+            self.lengths.append(0)
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        self.documents += 1
+        for term, count in Counter(tokens).items():
+            self.postings.setdefault(term, []).append((row_id, count))
+
+    def remove(self, row_id: int, listing):
+        """Drop a deleted row from the posting lists of its terms."""
+        self.total_length -= self.lengths[row_id]
+        self.lengths[row_id] = 0
+        self.documents -= 1
+        for term in set(tokenize(getattr(listing, self.field, None))):
+            postings = [entry for entry in self.postings.get(term, ()) if entry[0] != row_id]
+            if postings:
+                self.postings[term] = postings
+            else:
+                self.postings.pop(term, None)
+
+    def search(self, query: str, rows: Optional[Collection[int]] = None,
+               limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Return (row id, score) pairs, best first; ties keep row order.
+
+        rows, if given, restricts the results to those row ids, e.g. the rows
+        matching the structured filters.
+        """
+        documents = self.documents
+        if not documents:
+            return []
+        average_length = self.total_length / documents or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            frequency = len(postings)
+            idf = math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+            for row_id, count in postings:
+                if rows is not None and row_id not in rows:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[row_id] / average_length)
+                scores[row_id] = scores.get(row_id, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+
+        def key(item):
+            return (-item[1], item[0])
+
+        if limit is None:
+            return sorted(scores.items(), key=key)
+        return heapq.nsmallest(limit, scores.items(), key=key)